@@ -0,0 +1,226 @@
+import argparse
+import contextlib
+import io
+import json
+import random
+import subprocess
+import time
+from typing import Callable
+
+import numpy as np
+
+import main_loop
+
+def time_calls(fn: Callable, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        fn()
+    return (time.perf_counter() - start) / count
+
+def play_random(farm: main_loop.Farm, steps: int) -> None:
+    for i in range(steps):
+        mask = farm.get_available_actions()
+        farm.do_action(random.choice(np.flatnonzero(mask)), mask)
+        if farm.check_win():
+            farm.reset()
+
+def bench_env(grid_size: tuple, steps: int) -> dict:
+    farm = main_loop.Farm(grid_size, 1)
+    play_random(farm, 100)
+
+    mask = farm.get_available_actions()
+    results = {
+        "get_state_us": time_calls(farm.get_state, steps) * 1e6,
+        "get_available_actions_us": time_calls(farm.get_available_actions, steps) * 1e6,
+        "check_win_us": time_calls(farm.check_win, steps) * 1e6,
+    }
+
+    farm.reset()
+    start = time.perf_counter()
+    for i in range(steps):
+        mask = farm.get_available_actions()
+        farm.get_state()
+        farm.do_action(random.choice(np.flatnonzero(mask)), mask)
+        if farm.check_win():
+            farm.reset()
+    elapsed = time.perf_counter() - start
+
+    results["steps_per_second"] = steps / elapsed
+    results["do_action_us"] = (elapsed / steps) * 1e6 - results["get_state_us"] - results["get_available_actions_us"] - results["check_win_us"]
+    return results
+
+def bench_inference(bot: main_loop.Bot, batch_sizes: list, repeats: int) -> dict:
+    results = {}
+    for batch_size in batch_sizes:
+        states = np.random.randint(0, 2, (batch_size, main_loop.STATE_COUNT))
+        if bot.policy is bot.model:
+            # the Q-table is its own policy, there is no Keras model to compare with
+            table_time = time_calls(lambda: bot.policy.predict(states), repeats)
+            results[str(batch_size)] = {
+                "table_predict_ms": table_time * 1000,
+                "table_states_per_second": batch_size / table_time,
+            }
+            continue
+
+        keras_time = time_calls(lambda: bot.model.predict(states, batch_size=batch_size), repeats)
+        numpy_time = time_calls(lambda: bot.policy.predict(states), repeats)
+        results[str(batch_size)] = {
+            "keras_predict_ms": keras_time * 1000,
+            "numpy_predict_ms": numpy_time * 1000,
+            "keras_states_per_second": batch_size / keras_time,
+            "numpy_states_per_second": batch_size / numpy_time,
+        }
+    return results
+
+def bench_replay(bot: main_loop.Bot, repeats: int) -> dict:
+    count = bot.memory.capacity
+    bot._train_long(
+        np.random.randint(0, 2, (count, main_loop.STATE_COUNT)),
+        np.random.randint(0, 2, (count, main_loop.STATE_COUNT)),
+        np.random.randint(0, main_loop.ACTION_COUNT, count),
+        np.random.choice([-100, -10, 10], count).astype(float),
+        np.random.random_sample(count) < 0.01,
+    )
+
+    replay_time = time_calls(bot._redo_memory, repeats)
+    transitions = min(main_loop.REPLAY_BATCH_SIZE, len(bot.memory)) * main_loop.REPLAY_STEPS
+    return {
+        "redo_memory_ms": replay_time * 1000,
+        "transitions_per_second": transitions / replay_time,
+    }
+
+def bench_training(generations: int, max_steps: int) -> list:
+    main_loop.generation = 0
+    main_loop.farm = None
+    main_loop.init_key_items()
+    main_loop.init_grid()
+    bot = main_loop.key_items["bot"]
+    main_loop.warm_start(bot)
+
+    results = []
+    for i in range(generations):
+        start_generation = main_loop.generation
+        start = time.perf_counter()
+        start_updates = bot.updates
+        steps = 0
+        # _update prints the step count of every finished episode
+        with contextlib.redirect_stdout(io.StringIO()):
+            while main_loop.generation == start_generation and steps < max_steps:
+                bot._update(0)
+                steps += 1
+
+        wall_time = time.perf_counter() - start
+        results.append({
+            "generation": start_generation,
+            "won": main_loop.generation != start_generation,
+            "steps": steps,
+            "updates": bot.updates - start_updates,
+            "updates_per_second": (bot.updates - start_updates) / wall_time,
+            "wall_time_s": wall_time,
+        })
+
+        if main_loop.generation == start_generation:
+            break
+
+    return results
+
+def bench_solver(grid_size: tuple) -> dict:
+    if grid_size[0] * grid_size[1] > main_loop.SOLVER_MAX_CELLS:
+        return None
+
+    start = time.perf_counter()
+    solution = main_loop.solve_farm(grid_size)
+    return {
+        "optimal_steps": len(solution[0]) if solution else None,
+        "expanded_states": solution[2] if solution else None,
+        "solve_time_s": time.perf_counter() - start,
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark environment, inference and training throughput")
+    parser.add_argument("--grid-sizes", default="3x3", help="comma separated grid sizes, e.g. 3x3,10x10")
+    parser.add_argument("--backend", choices=("network", "table"), default=main_loop.POLICY_BACKEND, help="policy backend the bot learns with")
+    parser.add_argument("--mem-sizes", default=str(main_loop.MEM_SIZE), help="comma separated replay memory sizes")
+    parser.add_argument("--sections", default="env,inference,replay,training", help="comma separated sections to run: env, solver, inference, replay, training")
+    parser.add_argument("--env-steps", type=int, default=20000, help="environment steps per env measurement")
+    parser.add_argument("--batch-sizes", default="1,8,32,256", help="batch sizes for the inference measurement")
+    parser.add_argument("--repeats", type=int, default=50, help="calls per inference and replay measurement")
+    parser.add_argument("--generations", type=int, default=3, help="generations to train in the training section")
+    parser.add_argument("--max-steps", type=int, default=100000, help="give up on a generation after this many steps")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json", help="where to write the JSON results")
+    args = parser.parse_args()
+
+    sections = args.sections.split(",")
+    grid_sizes = [main_loop.parse_grid_size(size) for size in args.grid_sizes.split(",")]
+    mem_sizes = [int(size) for size in args.mem_sizes.split(",")]
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+
+    main_loop.POLICY_BACKEND = args.backend
+
+    runs = []
+    for grid_size in grid_sizes:
+        # the solver doesn't depend on the memory size, so it runs once per grid
+        solver = None
+        if "solver" in sections:
+            solver = bench_solver(grid_size)
+            if solver is None:
+                print("grid %dx%d: too large for the solver, skipping it" % (grid_size[0], grid_size[1]))
+            else:
+                print("grid %dx%d: solver found optimal %s steps in %.1f s" % (grid_size[0], grid_size[1], solver["optimal_steps"], solver["solve_time_s"]))
+
+        for mem_size in mem_sizes:
+            random.seed(args.seed)
+            np.random.seed(args.seed)
+            main_loop.GRID_SIZE = np.array(grid_size, dtype=int)
+            main_loop.MEM_SIZE = mem_size
+            main_loop.REPLAY_BATCH_SIZE = mem_size
+
+            run = {"backend": args.backend, "grid_size": list(grid_size), "mem_size": mem_size}
+            print("grid %dx%d, memory %d" % (grid_size[0], grid_size[1], mem_size))
+
+            if "env" in sections:
+                run["env"] = bench_env(grid_size, args.env_steps)
+                print("  env: %.0f steps/s" % run["env"]["steps_per_second"])
+
+            if solver is not None:
+                run["solver"] = solver
+
+            if "inference" in sections or "replay" in sections:
+                bot = main_loop.Bot()
+
+                if "inference" in sections:
+                    run["inference"] = bench_inference(bot, batch_sizes, args.repeats)
+                    for batch_size, result in run["inference"].items():
+                        timings = ", ".join("%s %.3f ms" % (name.split("_")[0], value) for name, value in result.items() if name.endswith("_predict_ms"))
+                        print("  inference batch %s: %s" % (batch_size, timings))
+
+                if "replay" in sections:
+                    run["replay"] = bench_replay(bot, args.repeats)
+                    print("  replay: %.1f ms, %.0f transitions/s" % (run["replay"]["redo_memory_ms"], run["replay"]["transitions_per_second"]))
+
+            if "training" in sections:
+                run["training"] = bench_training(args.generations, args.max_steps)
+                for result in run["training"]:
+                    print("  generation %d: %s in %d steps, %d updates at %.0f/s, %.2f s" % (
+                        result["generation"], "won" if result["won"] else "gave up", result["steps"], result["updates"], result["updates_per_second"], result["wall_time_s"]))
+
+            runs.append(run)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "runs": runs,
+        }, f, indent=2)
+
+    print("wrote %s" % args.output)
+
+if __name__ == "__main__":
+    main()
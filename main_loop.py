@@ -1,30 +1,110 @@
 import pygame
 import random
+import argparse
 from typing import Iterable
 import numpy as np
 import time
-from keras.utils import to_categorical
-import collections
-from keras.models import Sequential
-from keras.optimizers import Adam
-from keras.layers.core import Dense, Dropout
-
-SKIP_STEPS = 1
+import os
+import multiprocessing
+import queue
+import threading
+import pickle
+import glob
+import heapq
+
+RENDER_FPS = 30
+RENDER_EVERY_STEPS = 0
+# window events are handled this often however rarely frames are drawn
+EVENT_INTERVAL = 0.05
 GENERATIONS = 100
 EPSILON_DECAY = 1/(GENERATIONS*2)
+GAMMA = 0.9
+LEARNING_RATE = 0.0005
 MEM_SIZE = 500
+REPLAY_PATH = None
+PRIORITIZED_REPLAY = False
+PRIORITY_ALPHA = 0.6
+PRIORITY_BETA = 0.4
+PRIORITY_EPSILON = 0.01
+REPLAY_BATCH_SIZE = MEM_SIZE
+REPLAY_STEPS = 1
+TRAIN_SHORT_EPOCHS = 5
+TRAIN_EVERY_STEPS = 4
+TRAIN_BATCH_SIZE = 32
+TARGET_SYNC_STEPS = 500
+NUMPY_INFERENCE = True
+POLICY_BACKEND = "network"
+TABLE_LEARNING_RATE = 0.1
+WEIGHTS_PATH = "weights/w1.hdf5"
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_KEEP = 3
+RESUME = False
+RECORD_PATH = None
+TRAJECTORY_CHUNK_SIZE = 4096
+TRAJECTORY_MAGIC = b"FARMTRJ1"
+OFFLINE_BATCH_SIZE = 4096
+OFFLINE_EPOCHS = 1
+# the solver's state space grows exponentially with the farm's area, and a
+# 3x3 farm already takes about 180k expansions, 40 s and 800 MB
+SOLVER_MAX_CELLS = 9
+SOLVER_MAX_STATES = 250000
+PRETRAIN = False
+PRETRAIN_EPOCHS = 50
+FONT_PATH = "kenney_pixel_square.ttf"
+FONT_SIZE = 16
+
+PROFILE_PHASES = ("act", "step", "train_short", "train_batch", "redo_memory", "checkpoint", "render")
+PROFILE_COUNTERS = ("steps", "predicts", "fits", "updates", "invalid_actions")
+PROFILE_LOG_INTERVAL = 10.0
+
+ACTOR_COUNT = 4
+ACTOR_CHUNK_SIZE = 100
+ACTOR_QUEUE_DEPTH = 64
+ACTOR_REPORT_INTERVAL = 10.0
+WEIGHT_SYNC_INTERVAL = 1000
+# spawned actors re-import the module, so these are handed over explicitly
+ACTOR_SETTINGS = ("GRID_SIZE", "EPSILON_DECAY", "REWARD_INVALID", "REWARD_MOVE", "REWARD_SUCCESS", "REWARD_FAILURE")
 
 GRID_SIZE = np.array([3, 3], dtype=int)
+BOT_COUNT = 1
 CELL_SIZE = np.array([16, 16], dtype=int)
+VIEW_CELLS = np.array([48, 32], dtype=int)
+PLANT_CHUNK_SIZE = 32
 STATE_COUNT = 8
+ACTION_COUNT = 9
+
+NO_PLANT = -1
+NO_ITEM = 0
+ITEM_HOE = 1
+ITEM_SEEDS = 2
+ITEM_WATER = 4
+
+REWARD_INVALID = -10
+REWARD_MOVE = -100
+REWARD_SUCCESS = 10
+REWARD_FAILURE = -10
+
+EMPTY_CELL = (NO_PLANT, NO_ITEM, None)
+
+ITEM_NAMES = {
+    ITEM_HOE: "hoe",
+    ITEM_SEEDS: "seeds",
+    ITEM_WATER: "water",
+}
 
 clear_color = [115, 209, 94, 255]
 screen = None
-objects = {}
-paused = False
-steps = 0
+farm = None
+view_origin = np.array([0, 0], dtype=int)
+drawn_cells = None
 generation = 0
-font = None
+headless = False
+checkpoint_writer = None
+trajectory_recorder = None
+
+asset_images = {}
+asset_glyphs = {}
+asset_fonts = {}
 
 key_items = {
     "bot": None,
@@ -33,13 +113,99 @@ key_items = {
     "water": None,
 }
 
+class Profiler(object):
+    def __init__(self, enabled: bool = False, csv_path: str = None, log_interval: float = PROFILE_LOG_INTERVAL) -> None:
+        self.enabled = enabled
+        self.csv_path = csv_path
+        self.log_interval = log_interval
+        self.reset()
+
+    def reset(self) -> None:
+        self.totals = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.counters = dict.fromkeys(PROFILE_COUNTERS, 0)
+        self.generation_totals = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.generation_counters = dict.fromkeys(PROFILE_COUNTERS, 0)
+        self.generations = []
+        self.start_time = time.perf_counter()
+        self.generation_start_time = self.start_time
+        self.log_time = self.start_time
+
+    def start(self) -> float:
+        if not self.enabled:
+            return 0.0
+        return time.perf_counter()
+
+    def stop(self, phase: str, started: float) -> None:
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - started
+        self.totals[phase] += elapsed
+        self.generation_totals[phase] += elapsed
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        if not self.enabled:
+            return
+        self.counters[counter] += amount
+        self.generation_counters[counter] += amount
+
+    def end_generation(self, generation_number: int) -> None:
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        row = {"generation": generation_number, "wall_time": now - self.generation_start_time}
+        row.update(self.generation_totals)
+        row.update(self.generation_counters)
+        self.generations.append(row)
+
+        if self.csv_path:
+            write_header = not os.path.exists(self.csv_path)
+            with open(self.csv_path, "a") as f:
+                if write_header:
+                    f.write(",".join(row.keys()) + "\n")
+                f.write(",".join(str(v) for v in row.values()) + "\n")
+
+        self.generation_totals = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.generation_counters = dict.fromkeys(PROFILE_COUNTERS, 0)
+        self.generation_start_time = now
+
+    def maybe_log(self) -> None:
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        if now - self.log_time < self.log_interval:
+            return
+        self.log_time = now
+
+        elapsed = now - self.start_time
+        phases = " ".join("%s=%.1f%%" % (phase, 100 * self.totals[phase] / elapsed) for phase in PROFILE_PHASES)
+        counters = " ".join("%s=%d" % (counter, self.counters[counter]) for counter in PROFILE_COUNTERS)
+        print("profile %.0fs: %s %s updates/s=%.0f" % (elapsed, phases, counters, self.counters["updates"] / elapsed))
+
+    def report(self) -> dict:
+        return {
+            "elapsed": time.perf_counter() - self.start_time,
+            "totals": dict(self.totals),
+            "counters": dict(self.counters),
+            "generations": list(self.generations),
+        }
+
+profiler = Profiler()
+
 class GridObject(object):
+    item_flag = NO_ITEM
+    image_path = None
+
     def __init__(self):
         pygame.sprite.Sprite.__init__(self)
-        self.image = None
         self.grid_position = np.array([0, 0])
         pygame.sprite.Group().add(self)
 
+    @property
+    def image(self) -> pygame.Surface:
+        return get_image(self.image_path) if self.image_path else None
+
     def _update(self, delta: float) -> None:
         pass
 
@@ -50,9 +216,6 @@ class GridObject(object):
     def _input(self, event: pygame.event.Event):
         pass
 
-    def move(self, direction: Iterable) -> None:
-        self.grid_position = np.clip(self.grid_position + direction, 0, GRID_SIZE-1)
-
 class Bot(GridObject, pygame.sprite.Sprite):
     MOVE_LEFT = 0
     MOVE_RIGHT = 1
@@ -64,514 +227,1470 @@ class Bot(GridObject, pygame.sprite.Sprite):
     USE_ITEM = 7
     DROP_ITEM = 8
 
+    image_path = "robot.png"
+
     def __init__(self) -> None:
         GridObject.__init__(self)
-        self.image = pygame.image.load("robot.png")
-        self.grid_position = np.array([8, 4])
-        self.holding = None
-        
+
         self.epsilon = 1
-        self.gamma = 0.9
-        self.reward = 0
-        self.memory = collections.deque(maxlen=MEM_SIZE)
+        self.gamma = GAMMA
+        if PRIORITIZED_REPLAY:
+            self.memory = PrioritizedReplayMemory(MEM_SIZE, REPLAY_PATH)
+        else:
+            self.memory = ReplayMemory(MEM_SIZE, REPLAY_PATH)
+        self.next_q = None
+        self.updates = 0
+        self.steps_since_train = 0
+        self.steps_since_sync = 0
 
         self._init_model()
+        self.policy = self.model if POLICY_BACKEND == "table" else NumpyPolicy.from_model(self.model)
+        self.sync_target()
 
     def _init_model(self) -> None:
+        if POLICY_BACKEND == "table":
+            self.model = QTable()
+            return
+
+        from keras.models import Sequential
+        from keras.optimizers import Adam
+        from keras.layers.core import Dense
+
         self.model = Sequential()
         self.model.add(Dense(output_dim=120, activation="relu", input_dim=STATE_COUNT))
         self.model.add(Dense(output_dim=120, activation="relu"))
         self.model.add(Dense(output_dim=120, activation="relu"))
         self.model.add(Dense(output_dim=9, activation="softmax"))
-        self.model.compile(Adam(0.0005), loss="mean_squared_error")
+        self.model.compile(Adam(LEARNING_RATE), loss="mean_squared_error")
 
     def _update(self, delta: float) -> None:
-        global steps
-
         self.epsilon = 1 - (generation * EPSILON_DECAY)
 
-        start_actions = self.get_available_actions()
-        available_actions = []
-        for k, v in start_actions.items():
-            if v == 1:
-                available_actions.append(k)
-        
-        start_state = self.get_state(list(start_actions.values()))
-
-        if random.randint(0, 1) < self.epsilon:
-            action = np.random.choice(available_actions)
-        else:
-            a = np.asarray(start_state).reshape((1, STATE_COUNT))
-            p = self.model.predict(a)
-            action = np.argmax(p[0])
-            print(action)
+        # every bot on the farm acts each tick, with one predict for all of them
+        start_states, start_masks = farm.observe_bots()
+        bot_count = len(start_states)
 
-        self.do_action(action, available_actions)
+        started = profiler.start()
+        actions = self.choose_actions(start_states, start_masks, self.next_q)
+        profiler.stop("act", started)
 
-        end_actions = self.get_available_actions()
-        end_state = self.get_state(list(end_actions.values()))
+        started = profiler.start()
+        rewards, valid = farm.act_bots(actions)
+        end_states, _ = farm.observe_bots()
 
-        complete = check_win()
+        complete = farm.check_win()
+        farm.ticks += 1
+        profiler.stop("step", started)
+        profiler.count("steps", bot_count)
+        profiler.count("invalid_actions", int(bot_count - np.sum(valid)))
 
-        s = np.array(start_state).reshape((1, STATE_COUNT))
-        e = np.array(end_state).reshape((1, STATE_COUNT))
+        completes = np.full(bot_count, complete)
 
-        self._train_short(s, e, action, complete)
-        self._train_long(s, e, action, complete)
+        record_transitions(start_states, start_masks, actions, rewards, end_states, completes)
+        self.learn(start_states, end_states, actions, rewards, completes)
 
         if complete:
-            print(steps)
-            paused = True
-            key_items["bot"]._redo_memory()
-            key_items["bot"].model.save_weights("weights/w1.hdf5")
+            print(farm.ticks)
+            self.next_q = None
+            self._redo_memory()
+            profiler.end_generation(generation)
             init_grid()
+            save_checkpoint(self)
+
+    def choose_actions(self, states: np.ndarray, masks: np.ndarray, q_values: np.ndarray = None) -> np.ndarray:
+        return epsilon_greedy(states, masks, self.epsilon, self.predict, q_values)
+
+    def predict(self, states: np.ndarray) -> np.ndarray:
+        profiler.count("predicts")
+        if NUMPY_INFERENCE:
+            return self.policy.predict(states)
+        return self.model.predict(states, batch_size=len(states))
+
+    def fit(self, states: np.ndarray, targets: np.ndarray, epochs: int, sample_weight: np.ndarray = None) -> None:
+        profiler.count("fits")
+        profiler.count("updates", epochs)
+        self.updates += epochs
+        self.model.fit(states, targets, batch_size=len(states), epochs=epochs, verbose=0, sample_weight=sample_weight)
+        self.policy.sync(self.model)
+
+    def sync_target(self) -> None:
+        # frozen copy of the weights the bootstrap targets come from
+        self.target = None if TARGET_SYNC_STEPS <= 0 else load_policy(self.model.get_weights())
+
+    def save_weights(self, path: str = WEIGHTS_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if self.policy is not self.model:
+            self.model.save_weights(path)
+        self.policy.save(os.path.splitext(path)[0] + ".npz")
+        self.memory.flush()
+
+    def snapshot(self) -> dict:
+        return {
+            "weights": self.model.get_weights(),
+            "target": None if self.target is None else [w.copy() for w in self.target.weights],
+            "epsilon": self.epsilon,
+            "updates": self.updates,
+            "steps_since_train": self.steps_since_train,
+            "steps_since_sync": self.steps_since_sync,
+            "memory": self.memory.snapshot(),
+        }
 
-    def _train_short(self, start_actions, end_actions, action, complete) -> None:
-        t = self.reward
-        if not complete:
-            t = self.reward + self.gamma * np.amax(self.model.predict(end_actions)[0])
-
-        target = self.model.predict(start_actions)
-        target[0][np.argmax(action)] = t
-
-        self.model.fit(start_actions, target, epochs=5, verbose=0)
-
-    def _train_long(self, start_actions, end_actions, action, complete) -> None:
-        self.memory.append((start_actions, end_actions, action, self.reward, complete))
-
-    def _redo_memory(self):
-        if len(self.memory) > MEM_SIZE:
-            minibatch = random.sample(self.memory, MEM_SIZE)
+    def restore(self, snapshot: dict) -> None:
+        self.model.set_weights(snapshot["weights"])
+        self.policy.sync(self.model)
+        self.target = None if snapshot["target"] is None else load_policy(snapshot["target"])
+        self.epsilon = snapshot["epsilon"]
+        self.updates = snapshot["updates"]
+        self.steps_since_train = snapshot["steps_since_train"]
+        self.steps_since_sync = snapshot["steps_since_sync"]
+        self.memory.restore(snapshot["memory"])
+        self.next_q = None
+
+    def _compute_targets(self, start_states, end_states, actions, rewards, completes) -> tuple:
+        # One forward pass covers both ends of every transition; the end-state
+        # predictions are handed back so the next action choice can reuse them.
+        # With a target network the end states are valued by the frozen copy
+        # instead, so the targets stay put while the online weights move.
+        batch_size = len(start_states)
+        if self.target is None:
+            q = self.predict(np.vstack([start_states, end_states]))
+            targets = q[:batch_size]
+            next_q = q[batch_size:]
+        else:
+            targets = self.predict(start_states)
+            profiler.count("predicts")
+            next_q = self.target.predict(end_states)
+        rows = np.arange(batch_size)
+        expected = rewards + self.gamma * np.amax(next_q, axis=1) * ~completes
+        td_errors = expected - targets[rows, actions]
+        targets[rows, actions] = expected
+        return targets, next_q, td_errors
+
+    def learn(self, start_states, end_states, actions, rewards, completes) -> None:
+        if TRAIN_EVERY_STEPS > 0:
+            self._train_long(start_states, end_states, actions, rewards, completes)
+            self._train_scheduled(len(start_states))
         else:
-            minibatch = self.memory
-
-        for start_actions, end_actions, action, reward, complete in minibatch:
-            t = reward
-            if not complete:
-                t = reward + self.gamma * np.amax(self.model.predict(end_actions)[0])
-            
-            target = self.model.predict(start_actions)
-            target[0][np.argmax(action)] = t
-
-            self.model.fit(start_actions, target, epochs=1, verbose=0)
-
-    def do_action(self, action: int, viable_actions: list) -> None:
-        self.reward = 0
-        
-        if action not in viable_actions:
-            self.reward = -10
+            self._train_short(start_states, end_states, actions, rewards, completes)
+            self._train_long(start_states, end_states, actions, rewards, completes)
+
+        # both schedules bootstrap from the target, so both keep it fresh
+        self.steps_since_sync += len(start_states)
+        if TARGET_SYNC_STEPS > 0 and self.steps_since_sync >= TARGET_SYNC_STEPS:
+            self.steps_since_sync = 0
+            self.sync_target()
+
+    def _train_short(self, start_states, end_states, actions, rewards, completes) -> None:
+        started = profiler.start()
+        targets, next_q, _ = self._compute_targets(start_states, end_states, actions, rewards, completes)
+        self.next_q = next_q if self.target is None else None
+        self.fit(start_states, targets, TRAIN_SHORT_EPOCHS)
+        profiler.stop("train_short", started)
+
+    def _train_scheduled(self, step_count: int) -> None:
+        # one replay batch per TRAIN_EVERY_STEPS environment steps instead of a
+        # multi-epoch fit on every single transition
+        started = profiler.start()
+        self.steps_since_train += step_count
+        while self.steps_since_train >= TRAIN_EVERY_STEPS:
+            self.steps_since_train -= TRAIN_EVERY_STEPS
+            self._replay_batch(TRAIN_BATCH_SIZE)
+        profiler.stop("train_batch", started)
+
+    def _train_long(self, start_states, end_states, actions, rewards, completes) -> None:
+        self.memory.extend(start_states, end_states, actions, rewards, completes)
+
+    def _redo_memory(self) -> None:
+        if len(self.memory) == 0:
             return
-        
-        needs_water = False
-        needs_tilling = False
-        needs_seeds = False
-
-        start_pos = self.grid_position
-
-        for y in range(GRID_SIZE[1]):
-            for x in range(GRID_SIZE[0]):
-                has_plant = False
-                
-                for o in get_objects_at([x, y]):
-                    if isinstance(o, Plant):
-                        has_plant = True
-
-                        plant_state = o.stage
-                        if plant_state == Plant.STAGE_PLANTED:
-                            needs_tilling = True
-                        elif plant_state == Plant.STAGE_TILLED:
-                            needs_water = True
-
-                if not has_plant:
-                    needs_tilling = True
-
-        if action == Bot.MOVE_LEFT:
-            self.move(np.array([-1, 0]))
-            self.reward = -100
-            # if start_pos[0] == self.grid_position[0] and start_pos[1] == self.grid_position[1]:
-            #     self.reward = -10
-        elif action == Bot.MOVE_RIGHT:
-            self.move(np.array([1, 0]))
-            self.reward = -100
-            # if start_pos[0] == self.grid_position[0] and start_pos[1] == self.grid_position[1]:
-            #     self.reward = -10
-        elif action == Bot.MOVE_UP:
-            self.move(np.array([0, -1]))
-            self.reward = -100
-            # if start_pos[0] == self.grid_position[0] and start_pos[1] == self.grid_position[1]:
-            #     self.reward = -10
-        elif action == Bot.MOVE_DOWN:
-            self.move(np.array([0, 1]))
-            self.reward = -100
-            # if start_pos[0] == self.grid_position[0] and start_pos[1] == self.grid_position[1]:
-            #     self.reward = -10
-        elif action == Bot.PICKUP_HOE:
-            ground_objects = get_objects_at(self.grid_position)
-
-            found_hoe = False
-
-            for o in ground_objects:
-                if isinstance(o, Hoe):
-                    self.holding = key_items["hoe"]
-                    remove_object(key_items["hoe"])
-                    found_hoe = True
-                    break
-
-            if found_hoe:
-                if isinstance(self.holding, Hoe):
-                    self.reward = -10 if needs_tilling else 10
-            else:
-                self.reward = -10
-        elif action == Bot.PICKUP_SEEDS:
-            ground_objects = get_objects_at(self.grid_position)
 
-            found_seeds = False
+        started = profiler.start()
+        for _ in range(REPLAY_STEPS):
+            self._replay_batch(REPLAY_BATCH_SIZE)
 
-            for o in ground_objects:
-                if isinstance(o, Seeds):
-                    self.holding = key_items["seeds"]
-                    remove_object(key_items["seeds"])
-                    found_seeds = True
-                    break
-
-            if found_seeds:
-                if isinstance(self.holding, Seeds):
-                    self.reward = -10 if needs_seeds else 10
-            else:
-                self.reward = -10
-        elif action == Bot.PICKUP_WATER:
-            ground_objects = get_objects_at(self.grid_position)
-
-            found_water = False
-
-            for o in ground_objects:
-                if isinstance(o, Water):
-                    self.holding = key_items["water"]
-                    remove_object(key_items["water"])
-                    found_water = True
-                    break
-
-            if found_water:
-                if isinstance(self.holding, Water):
-                    self.reward = -10 if needs_water else 10
-            else:
-                self.reward = -10
-        elif action == Bot.USE_ITEM:
-            self.reward = -10
-
-            if isinstance(self.holding, Hoe):
-                ground_objects = get_objects_at(self.grid_position)
-                has_plant = False
-                for o in ground_objects:
-                    if isinstance(o, Plant):
-                        has_plant = True
-                        break
-                
-                if not has_plant:
-                    self.reward = 10
-                    plant = Plant()
-                    plant.grid_position = self.grid_position
-                    add_object(plant, self.grid_position)
-            elif isinstance(self.holding, Seeds):
-                ground_objects = get_objects_at(self.grid_position)
-                for o in ground_objects:
-                    if isinstance(o, Plant):
-                        o.stage = Plant.STAGE_PLANTED
-                        self.reward = 10
-                        break
-            elif isinstance(self.holding, Water):
-                ground_objects = get_objects_at(self.grid_position)
-                for o in ground_objects:
-                    if isinstance(o, Plant):
-                        self.reward = 10
-                        o.stage = Plant.STAGE_GROWN
-                        break
-        elif action == Bot.DROP_ITEM:
-            if (isinstance(self.holding, Hoe) and needs_tilling or
-                isinstance(self.holding, Seeds) and needs_seeds or
-                isinstance(self.holding, Water) and needs_water):
-                self.reward = -10
-            
-            if (isinstance(self.holding, Hoe) and not needs_tilling or
-                isinstance(self.holding, Seeds) and not needs_seeds or
-                isinstance(self.holding, Water) and not needs_water):
-                self.reward = 10
-
-            self.holding.grid_position = self.grid_position
-            add_object(self.holding, self.holding.grid_position)
-            self.holding = None
-
-    def get_state(self, actions) -> list:
-        global key_items
-
-        needs_water = False
-        needs_tilling = False
-        needs_seeds = False
-
-        for y in range(GRID_SIZE[1]):
-            for x in range(GRID_SIZE[0]):
-                has_plant = False
-                
-                for o in get_objects_at([x, y]):
-                    if isinstance(o, Plant):
-                        has_plant = True
-
-                        plant_state = o.stage
-                        if plant_state == Plant.STAGE_PLANTED:
-                            needs_water = True
-                        elif plant_state == Plant.STAGE_TILLED:
-                            needs_seeds = True
-
-                if not has_plant:
-                    needs_tilling = True
-
-        state = [
-            # # Hoe Direction
-            # key_items["hoe"].grid_position[0] < self.grid_position[0],
-            # key_items["hoe"].grid_position[1] < self.grid_position[1],
-            # key_items["hoe"].grid_position[0] > self.grid_position[0],
-            # key_items["hoe"].grid_position[1] > self.grid_position[1],
-            
-            # # Seeds Direction
-            # key_items["seeds"].grid_position[0] < self.grid_position[0],
-            # key_items["seeds"].grid_position[1] < self.grid_position[1],
-            # key_items["seeds"].grid_position[0] > self.grid_position[0],
-            # key_items["seeds"].grid_position[1] > self.grid_position[1],
-            
-            # # Water Direction
-            # key_items["water"].grid_position[0] < self.grid_position[0],
-            # key_items["water"].grid_position[1] < self.grid_position[1],
-            # key_items["water"].grid_position[0] > self.grid_position[0],
-            # key_items["water"].grid_position[1] > self.grid_position[1],
-
-            self.holding != None,
-            isinstance(self.holding, Hoe),
-            isinstance(self.holding, Seeds),
-            isinstance(self.holding, Water),
-
-            needs_tilling,
-            needs_seeds,
-            needs_water,
-
-            self.holding_matches_at(self.grid_position),
-            # self.holding_matches_at(self.grid_position + np.array([-1, 0])),
-            # self.holding_matches_at(self.grid_position + np.array([1, 0])),
-            # self.holding_matches_at(self.grid_position + np.array([0, 1])),
-            # self.holding_matches_at(self.grid_position + np.array([0, -1])),
-            
-            # is_inside_grid(self.grid_position + np.array([-1, 0])),
-            # is_inside_grid(self.grid_position + np.array([1, 0])),
-            # is_inside_grid(self.grid_position + np.array([0, 1])),
-            # is_inside_grid(self.grid_position + np.array([0, -1])),
-        ]
-
-        for i in range(len(state)):
-            state[i] = int(state[i])
-
-        return state# + actions
-
-    def holding_matches_at(self, pos) -> bool:
-        needs = get_needs_at(pos)
-        return ((isinstance(self.holding, Hoe) and needs[0]) or
-            (isinstance(self.holding, Seeds) and needs[1]) or
-            (isinstance(self.holding, Water) and needs[2]))
-
-
-    def get_available_actions(self) -> dict:
-        actions = {
-            Bot.MOVE_LEFT: 0,
-            Bot.MOVE_RIGHT: 0,
-            Bot.MOVE_UP: 0,
-            Bot.MOVE_DOWN: 0,
-            Bot.PICKUP_HOE: 0,
-            Bot.PICKUP_SEEDS: 0,
-            Bot.PICKUP_WATER: 0,
-            Bot.USE_ITEM: 0,
-            Bot.DROP_ITEM: 0,
-        }
+        self.next_q = None
+        profiler.stop("redo_memory", started)
 
-        dirs = {
-            Bot.MOVE_LEFT: [-1, 0], 
-            Bot.MOVE_RIGHT: [1, 0], 
-            Bot.MOVE_UP: [0, -1], 
-            Bot.MOVE_DOWN: [0, 1]
-        }
+    def _replay_batch(self, batch_size: int) -> None:
+        weights = None
+        if PRIORITIZED_REPLAY:
+            beta = min(1.0, PRIORITY_BETA + (1 - PRIORITY_BETA) * generation / GENERATIONS)
+            batch, indices, weights = self.memory.sample_prioritized(batch_size, beta)
+        else:
+            batch = self.memory.sample(batch_size)
+        start_states, end_states, actions, rewards, completes = batch
 
-        ground_objects = get_objects_at(self.grid_position)
-        
-        for k, v in dirs.items():
-            pos = self.grid_position + np.array(v)
-            if is_inside_grid(pos) and not is_collision_at(pos):
-                actions[k] = 1
-
-        if self.holding == None:
-            for obj in ground_objects:
-                if isinstance(obj, Hoe):
-                    actions[Bot.PICKUP_HOE] = 1
-                if isinstance(obj, Seeds):
-                    actions[Bot.PICKUP_SEEDS] = 1
-                if isinstance(obj, Water):
-                    actions[Bot.PICKUP_WATER] = 1
-
-        if self.holding != None:
-            actions[Bot.DROP_ITEM] = 1
-
-        plant_state = -1
-        for o in ground_objects:
-            if isinstance(o, Plant):
-                plant_state = o.stage
-                break
+        targets, _, td_errors = self._compute_targets(start_states, end_states, actions, rewards, completes)
 
-        if plant_state == -1:
-            if isinstance(self.holding, Hoe):
-                actions[Bot.USE_ITEM] = 1
-        else:
-            if plant_state == Plant.STAGE_PLANTED and isinstance(self.holding, Water):
-                actions[Bot.USE_ITEM] = 1
-            elif plant_state == Plant.STAGE_TILLED and isinstance(self.holding, Seeds):
-                actions[Bot.USE_ITEM] = 1
-        
-        return actions
+        self.fit(start_states, targets, 1, weights)
 
-    def _draw(self) -> None:
-        GridObject._draw(self)
-        if self.holding and self.holding.image:
-            draw_surface(self.holding.image, self.grid_position * CELL_SIZE + np.array([8, 0]))
+        if PRIORITIZED_REPLAY:
+            self.memory.update_priorities(indices, td_errors)
 
 class Hoe(GridObject, pygame.sprite.Sprite):
+    item_flag = ITEM_HOE
+    image_path = "hoe.png"
+
     def __init__(self) -> None:
         GridObject.__init__(self)
-        self.image = pygame.image.load("hoe.png")
-        self.grid_position = np.array([0, 4])
+        self.grid_position = get_spawn_position(ITEM_HOE, GRID_SIZE)
 
 class Seeds(GridObject, pygame.sprite.Sprite):
+    item_flag = ITEM_SEEDS
+    image_path = "seeds.png"
+
     def __init__(self) -> None:
         GridObject.__init__(self)
-        self.image = pygame.image.load("seeds.png")
-        self.grid_position = np.array([GRID_SIZE[0]-1, 4])
+        self.grid_position = get_spawn_position(ITEM_SEEDS, GRID_SIZE)
 
 class Water(GridObject, pygame.sprite.Sprite):
+    item_flag = ITEM_WATER
+    image_path = "water.png"
+
     def __init__(self) -> None:
         GridObject.__init__(self)
-        self.image = pygame.image.load("water.png")
-        self.grid_position = np.array([8, 0])
+        self.grid_position = get_spawn_position(ITEM_WATER, GRID_SIZE)
 
-class Plant(GridObject, pygame.sprite.Sprite):
+class Plant(object):
     STAGE_TILLED = 0
     STAGE_PLANTED = 1
     STAGE_GROWN = 2
     STAGE_CRUSHED = 3
 
-    stage_surfaces = {}
+    STAGE_ASSETS = {
+        STAGE_TILLED: ("tilled.png", "~", (162, 42, 42)),
+        STAGE_PLANTED: ("planted.png", ",", (0, 255, 0)),
+        STAGE_GROWN: ("grown.png", "\"", (255, 0, 0)),
+        STAGE_CRUSHED: ("crushed.png", "X", (255, 0, 0)),
+    }
+
+    @classmethod
+    def get_stage_surface(cls, stage: int) -> pygame.Surface:
+        return get_image(cls.STAGE_ASSETS[stage][0])
+
+    @classmethod
+    def get_stage_glyph(cls, stage: int) -> pygame.Surface:
+        return get_glyph(cls.STAGE_ASSETS[stage][1], cls.STAGE_ASSETS[stage][2])
+
+def configure(settings: dict) -> None:
+    # overrides module settings by name, e.g. {"GAMMA": 0.8}, for runs driven from another script
+    for name, value in settings.items():
+        if not name.isupper() or name not in globals():
+            raise ValueError("unknown setting %s" % name)
+        globals()[name] = value
+
+def get_spawn_position(item: int, size: Iterable) -> np.ndarray:
+    # NO_ITEM is the bot, which starts on the right edge facing the items
+    width, height = int(size[0]), int(size[1])
+    return {
+        NO_ITEM: np.array([width - 1, height // 2], dtype=int),
+        ITEM_HOE: np.array([width // 2, 0], dtype=int),
+        ITEM_SEEDS: np.array([width // 2, height - 1], dtype=int),
+        ITEM_WATER: np.array([0, height // 2], dtype=int),
+    }[item]
+
+def parse_grid_size(text: str) -> tuple:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+class Farm(object):
+    MOVE_DIRECTIONS = {
+        Bot.MOVE_LEFT: (-1, 0),
+        Bot.MOVE_RIGHT: (1, 0),
+        Bot.MOVE_UP: (0, -1),
+        Bot.MOVE_DOWN: (0, 1),
+    }
+
+    PICKUP_ITEMS = {
+        Bot.PICKUP_HOE: ITEM_HOE,
+        Bot.PICKUP_SEEDS: ITEM_SEEDS,
+        Bot.PICKUP_WATER: ITEM_WATER,
+    }
+
+    def __init__(self, size: Iterable = None, bot_count: int = None) -> None:
+        self.size = np.array(GRID_SIZE if size is None else size, dtype=int)
+        self.area = int(np.prod(self.size))
+        self.bot_count = BOT_COUNT if bot_count is None else bot_count
+        self.spawn()
+        self.initial_snapshot = self.snapshot()
+
+    def reset(self) -> None:
+        self.restore(self.initial_snapshot)
+
+    def spawn(self) -> None:
+        # only cells that have been worked are stored, untouched cells are NO_PLANT
+        self.steps = 0
+        self.ticks = 0
+        self.plant_stages = {}
+        self.plant_chunks = {}
+        self.item_cells = {}
+        self.stage_counts = [self.area, 0, 0, 0, 0]
+
+        # bots line up along the right edge, the first one where a lone bot starts
+        x, y = get_spawn_position(NO_ITEM, self.size)
+        spacing = max(self.size[1] // self.bot_count, 1)
+        self.bot_positions = np.array([[x, (y + i * spacing) % self.size[1]] for i in range(self.bot_count)], dtype=int)
+        self.holdings = [NO_ITEM] * self.bot_count
+        self.active_bot = 0
+        self.bot_position = self.bot_positions[0].copy()
+        self.holding = NO_ITEM
+
+        for item in (ITEM_HOE, ITEM_SEEDS, ITEM_WATER):
+            self.add_item(item, get_spawn_position(item, self.size))
+
+    def snapshot(self) -> tuple:
+        # Copies of the sparse containers, bot arrays and counters, which is
+        # the whole world. Values are ints, so shallow copies are enough.
+        self.select_bot(self.active_bot)
+        return (
+            self.steps, self.ticks, self.active_bot,
+            self.plant_stages.copy(),
+            {chunk: cells.copy() for chunk, cells in self.plant_chunks.items()},
+            self.item_cells.copy(),
+            list(self.stage_counts),
+            self.bot_positions.copy(),
+            list(self.holdings),
+        )
+
+    def restore(self, snapshot: tuple) -> None:
+        # copies again, so a snapshot can be restored any number of times
+        self.steps, self.ticks, self.active_bot, plants, chunks, items, stage_counts, positions, holdings = snapshot
+        self.plant_stages = plants.copy()
+        self.plant_chunks = {chunk: cells.copy() for chunk, cells in chunks.items()}
+        self.item_cells = items.copy()
+        self.stage_counts = list(stage_counts)
+        self.bot_positions = positions.copy()
+        self.holdings = list(holdings)
+        self.bot_count = len(holdings)
+        self.bot_position = self.bot_positions[self.active_bot].copy()
+        self.holding = self.holdings[self.active_bot]
+
+    def select_bot(self, index: int) -> None:
+        # bot_position and holding always describe the selected bot, so the
+        # single-bot rules below apply unchanged to any of them
+        self.bot_positions[self.active_bot] = self.bot_position
+        self.holdings[self.active_bot] = self.holding
+        self.active_bot = index
+        self.bot_position = self.bot_positions[index].copy()
+        self.holding = self.holdings[index]
+
+    def get_bots(self) -> list:
+        self.select_bot(self.active_bot)
+        return [((int(position[0]), int(position[1])), holding) for position, holding in zip(self.bot_positions, self.holdings)]
+
+    def observe_bots(self) -> tuple:
+        state_bits = []
+        action_bits = []
+        for i in range(self.bot_count):
+            self.select_bot(i)
+            state_bits.append(self.get_state_bits())
+            action_bits.append(self.get_action_bits())
+        return STATE_FEATURES[state_bits], ACTION_MASKS[action_bits]
+
+    def act_bots(self, actions: np.ndarray) -> tuple:
+        # Bots act in index order on the world the earlier ones left behind, so
+        # when two go for the same item or cell in one tick the lower index gets
+        # it and the other's action no longer passes the mask. Returns the
+        # rewards and whether each action passed the mask it was checked against.
+        rewards = np.zeros(self.bot_count)
+        valid = np.zeros(self.bot_count, dtype=bool)
+        for i in range(self.bot_count):
+            self.select_bot(i)
+            action_mask = self.get_available_actions()
+            valid[i] = action_mask[actions[i]]
+            rewards[i] = self.do_action(actions[i], action_mask)
+        return rewards, valid
+
+    def get_plant_stage_at(self, position: Iterable) -> int:
+        return self.plant_stages.get((int(position[0]), int(position[1])), NO_PLANT)
+
+    def set_plant_stage(self, position: Iterable, stage: int) -> None:
+        cell = (int(position[0]), int(position[1]))
+        self.stage_counts[self.plant_stages.get(cell, NO_PLANT) - NO_PLANT] -= 1
+        self.stage_counts[stage - NO_PLANT] += 1
+
+        chunk = (cell[0] // PLANT_CHUNK_SIZE, cell[1] // PLANT_CHUNK_SIZE)
+        if stage == NO_PLANT:
+            self.plant_stages.pop(cell, None)
+            self.plant_chunks.get(chunk, set()).discard(cell)
+        else:
+            self.plant_stages[cell] = stage
+            self.plant_chunks.setdefault(chunk, set()).add(cell)
+
+    def get_plants_in(self, start: Iterable, end: Iterable) -> list:
+        plants = []
+        for cx in range(int(start[0]) // PLANT_CHUNK_SIZE, (int(end[0]) - 1) // PLANT_CHUNK_SIZE + 1):
+            for cy in range(int(start[1]) // PLANT_CHUNK_SIZE, (int(end[1]) - 1) // PLANT_CHUNK_SIZE + 1):
+                for cell in self.plant_chunks.get((cx, cy), ()):
+                    if start[0] <= cell[0] < end[0] and start[1] <= cell[1] < end[1]:
+                        plants.append((cell, self.plant_stages[cell]))
+        return plants
+
+    def count_plant_stage(self, stage: int) -> int:
+        return self.stage_counts[stage - NO_PLANT]
+
+    def get_items_at(self, position: Iterable) -> int:
+        return self.item_cells.get((int(position[0]), int(position[1])), NO_ITEM)
+
+    def add_item(self, item: int, position: Iterable) -> None:
+        cell = (int(position[0]), int(position[1]))
+        self.item_cells[cell] = self.item_cells.get(cell, NO_ITEM) | item
+
+    def remove_item(self, item: int, position: Iterable) -> None:
+        cell = (int(position[0]), int(position[1]))
+        items = self.item_cells.get(cell, NO_ITEM) & ~item
+        if items == NO_ITEM:
+            self.item_cells.pop(cell, None)
+        else:
+            self.item_cells[cell] = items
+
+    def check_win(self) -> bool:
+        return self.count_plant_stage(Plant.STAGE_GROWN) + self.count_plant_stage(Plant.STAGE_CRUSHED) == self.area
+
+    def get_world(self) -> tuple:
+        # hashable copy of everything do_action depends on, the step counter aside
+        return (
+            int(self.bot_position[0]), int(self.bot_position[1]), self.holding,
+            tuple(sorted(self.item_cells.items())),
+            tuple(sorted(self.plant_stages.items())),
+        )
+
+    def set_world(self, world: tuple) -> None:
+        x, y, holding, items, plants = world
+        self.steps = 0
+        self.bot_position = np.array([x, y], dtype=int)
+        self.holding = holding
+        self.item_cells = dict(items)
+        self.plant_stages = dict(plants)
+
+        self.plant_chunks = {}
+        self.stage_counts = [self.area - len(plants), 0, 0, 0, 0]
+        for cell, stage in plants:
+            self.plant_chunks.setdefault((cell[0] // PLANT_CHUNK_SIZE, cell[1] // PLANT_CHUNK_SIZE), set()).add(cell)
+            self.stage_counts[stage - NO_PLANT] += 1
+
+    def remaining_steps_bound(self) -> int:
+        # Every cell still needs one use per missing stage, and the cells needing
+        # an item are visited while holding it, which takes one move per cell
+        # after the first. Switching between the k items still needed costs a
+        # pickup each and a drop before every pickup but one, so this never
+        # overestimates the number of steps left.
+        untouched = self.count_plant_stage(NO_PLANT)
+        tilled = self.count_plant_stage(Plant.STAGE_TILLED)
+        planted = self.count_plant_stage(Plant.STAGE_PLANTED)
+        visits = {ITEM_HOE: untouched, ITEM_SEEDS: untouched + tilled, ITEM_WATER: untouched + tilled + planted}
+
+        uses = sum(visits.values())
+        moves = sum(max(count - 1, 0) for count in visits.values())
+        pickups = sum(1 for item, count in visits.items() if count > 0 and item != self.holding)
+        drops = max(pickups - 1 + (self.holding != NO_ITEM), 0) if pickups else 0
+        return uses + moves + pickups + drops
+
+    def get_state_bits(self) -> int:
+        # bit i of the result is feature i of get_state
+        stage = self.get_plant_stage_at(self.bot_position)
+        return (HOLDING_STATE_BITS[self.holding] |
+            (self.stage_counts[NO_PLANT - NO_PLANT] > 0) << 4 |
+            (self.stage_counts[Plant.STAGE_TILLED - NO_PLANT] > 0) << 5 |
+            (self.stage_counts[Plant.STAGE_PLANTED - NO_PLANT] > 0) << 6 |
+            ITEM_USE_STAGES[self.holding][stage - NO_PLANT] << 7)
+
+    def get_action_bits(self) -> int:
+        x, y = self.bot_position
+        stage = self.get_plant_stage_at(self.bot_position)
+        bits = ITEM_ACTION_BITS[self.holding][self.get_items_at(self.bot_position)][stage - NO_PLANT]
+
+        if x > 0:
+            bits |= 1 << Bot.MOVE_LEFT
+        if x < self.size[0] - 1:
+            bits |= 1 << Bot.MOVE_RIGHT
+        if y > 0:
+            bits |= 1 << Bot.MOVE_UP
+        if y < self.size[1] - 1:
+            bits |= 1 << Bot.MOVE_DOWN
+
+        return bits
+
+    def get_state(self) -> np.ndarray:
+        return STATE_FEATURES[self.get_state_bits()]
+
+    def get_available_actions(self) -> np.ndarray:
+        return ACTION_MASKS[self.get_action_bits()]
+
+    def needs_item(self, item: int) -> bool:
+        return self.stage_counts[ITEM_TARGET_STAGES[item] - NO_PLANT] > 0
+
+    def do_action(self, action: int, action_mask: np.ndarray) -> int:
+        self.steps += 1
+
+        if not action_mask[action]:
+            return REWARD_INVALID
+
+        reward = 0
+
+        if action in self.MOVE_DIRECTIONS:
+            self.bot_position = np.clip(self.bot_position + self.MOVE_DIRECTIONS[action], 0, self.size-1)
+            reward = REWARD_MOVE
+        elif action in self.PICKUP_ITEMS:
+            item = self.PICKUP_ITEMS[action]
+            if self.get_items_at(self.bot_position) & item:
+                self.remove_item(item, self.bot_position)
+                self.holding = item
+                reward = REWARD_SUCCESS if self.needs_item(item) else REWARD_FAILURE
+            else:
+                reward = REWARD_FAILURE
+        elif action == Bot.USE_ITEM:
+            reward = REWARD_FAILURE
+            plant_state = self.get_plant_stage_at(self.bot_position)
+
+            if self.holding == ITEM_HOE:
+                if plant_state == NO_PLANT:
+                    reward = REWARD_SUCCESS
+                    self.set_plant_stage(self.bot_position, Plant.STAGE_TILLED)
+            elif self.holding == ITEM_SEEDS:
+                if plant_state != NO_PLANT:
+                    reward = REWARD_SUCCESS
+                    self.set_plant_stage(self.bot_position, Plant.STAGE_PLANTED)
+            elif self.holding == ITEM_WATER:
+                if plant_state != NO_PLANT:
+                    reward = REWARD_SUCCESS
+                    self.set_plant_stage(self.bot_position, Plant.STAGE_GROWN)
+        elif action == Bot.DROP_ITEM:
+            reward = REWARD_FAILURE if self.needs_item(self.holding) else REWARD_SUCCESS
+            self.add_item(self.holding, self.bot_position)
+            self.holding = NO_ITEM
+
+        return reward
+
+def build_bit_table(bit_count: int) -> np.ndarray:
+    table = ((np.arange(1 << bit_count)[:, None] >> np.arange(bit_count)) & 1).astype(np.int8)
+    table.flags.writeable = False
+    return table
+
+def build_item_use_stages() -> list:
+    table = [[False] * 5 for _ in range(ITEM_WATER + 1)]
+    for item, stage in ITEM_TARGET_STAGES.items():
+        table[item][stage - NO_PLANT] = True
+    return table
+
+def build_holding_state_bits() -> list:
+    # the held-item bits of get_state: bit 0 holding anything, bits 1-3 which item
+    table = [0] * (ITEM_WATER + 1)
+    for item in (ITEM_HOE, ITEM_SEEDS, ITEM_WATER):
+        table[item] = 1 | item << 1
+    return table
+
+def build_item_action_bits() -> list:
+    # indexed by [holding][ground items][plant stage - NO_PLANT], move bits are added per step
+    table = [[[0] * 5 for _ in range((ITEM_HOE | ITEM_SEEDS | ITEM_WATER) + 1)] for _ in range(ITEM_WATER + 1)]
+    for holding in (NO_ITEM, ITEM_HOE, ITEM_SEEDS, ITEM_WATER):
+        for ground_items in range(len(table[holding])):
+            for stage in range(NO_PLANT, Plant.STAGE_CRUSHED + 1):
+                bits = 0
+                if holding == NO_ITEM:
+                    for action, item in Farm.PICKUP_ITEMS.items():
+                        if ground_items & item:
+                            bits |= 1 << action
+                else:
+                    bits |= 1 << Bot.DROP_ITEM
+                if ITEM_USE_STAGES[holding][stage - NO_PLANT]:
+                    bits |= 1 << Bot.USE_ITEM
+                table[holding][ground_items][stage - NO_PLANT] = bits
+    return table
+
+ITEM_TARGET_STAGES = {
+    ITEM_HOE: NO_PLANT,
+    ITEM_SEEDS: Plant.STAGE_TILLED,
+    ITEM_WATER: Plant.STAGE_PLANTED,
+}
 
-    def __init__(self) -> None:
-        GridObject.__init__(self)
-        self._stage = 0
-        self.stage_surfaces[self.STAGE_TILLED] = pygame.image.load("tilled.png"), font.render("~", False, pygame.Color(162, 42, 42)),
-        self.stage_surfaces[self.STAGE_PLANTED] = pygame.image.load("planted.png"), font.render(",", False, pygame.Color(0, 255, 0)),
-        self.stage_surfaces[self.STAGE_GROWN] = pygame.image.load("grown.png"), font.render("\"", False, pygame.Color(255, 0, 0))
-        self.stage_surfaces[self.STAGE_CRUSHED] = pygame.image.load("crushed.png"), font.render("X", False, pygame.Color(255, 0, 0))
-        self.stage = Plant.STAGE_TILLED
+STATE_FEATURES = build_bit_table(STATE_COUNT)
+ACTION_MASKS = build_bit_table(ACTION_COUNT)
+ITEM_USE_STAGES = build_item_use_stages()
+HOLDING_STATE_BITS = build_holding_state_bits()
+ITEM_ACTION_BITS = build_item_action_bits()
 
+class NumpyPolicy(object):
+    def __init__(self, weights: list) -> None:
+        self.weights = [np.asarray(w, dtype=np.float32) for w in weights]
 
-    @property
-    def stage(self) -> int:
-        return self._stage
+    @classmethod
+    def from_model(cls, model) -> "NumpyPolicy":
+        return cls(model.get_weights())
 
-    @stage.setter
-    def stage(self, to: int) -> None:
-        self._stage = to
-        self.image = self.stage_surfaces[to][0]
+    @classmethod
+    def from_file(cls, path: str) -> "NumpyPolicy":
+        return cls(cls.read_weights(path))
 
-def draw_surface(surface: pygame.Surface, position: Iterable) -> None:
-    screen.blit(surface, position)
+    @staticmethod
+    def read_weights(path: str) -> list:
+        if path.endswith(".npz"):
+            with np.load(path) as data:
+                return [data["arr_%d" % i] for i in range(len(data.files))]
+
+        import h5py
+
+        weights = []
+        with h5py.File(path, "r") as f:
+            group = f["model_weights"] if "model_weights" in f else f
+            for layer_name in group.attrs["layer_names"]:
+                layer = group[_decode_name(layer_name)]
+                for weight_name in layer.attrs["weight_names"]:
+                    weights.append(np.array(layer[_decode_name(weight_name)]))
 
-def is_inside_grid(position: Iterable) -> bool:
-    return (position[0] >= 0 and position[1] >= 0 and position[0] < GRID_SIZE[0] and position[1] < GRID_SIZE[1])
+        return weights
 
-def get_objects_at(position: Iterable) -> Iterable:
-    return objects[(position[0], position[1])]
+    def sync(self, model) -> None:
+        self.weights = [np.asarray(w, dtype=np.float32) for w in model.get_weights()]
 
-def get_needs_at(position: Iterable) -> Iterable:
-    needs = [False, False, False]
+    def save(self, path: str) -> None:
+        np.savez(path, *self.weights)
 
-    if is_inside_grid(position):
-        has_plant = False
-        for o in get_objects_at(position):
-            if isinstance(o, Plant):
-                if o.stage == Plant.STAGE_PLANTED:
-                    needs[2] = True
-                elif o.stage == Plant.STAGE_TILLED:
-                    needs[1] = True
-        
-        if not has_plant:
-            needs[0] = True
+    def predict(self, states: np.ndarray) -> np.ndarray:
+        x = np.asarray(states, dtype=np.float32)
 
-    return needs
+        for i in range(0, len(self.weights) - 2, 2):
+            x = np.maximum(x @ self.weights[i] + self.weights[i + 1], 0)
 
-def is_collision_at(position: Iterable) -> bool:
-    for obj in get_objects_at(position):
+        x = x @ self.weights[-2] + self.weights[-1]
+        x = np.exp(x - np.amax(x, axis=1, keepdims=True))
+        return x / np.sum(x, axis=1, keepdims=True)
+
+class QTable(object):
+    # Stands in for both the Keras model and its NumpyPolicy: the state space is
+    # only 2**STATE_COUNT states, so every Q value can be stored directly.
+    def __init__(self, weights: list = None, learning_rate: float = None) -> None:
+        if weights is None:
+            self.table = np.zeros((1 << STATE_COUNT, ACTION_COUNT), dtype=np.float32)
+        else:
+            self.table = np.array(weights[0], dtype=np.float32)
+        self.learning_rate = TABLE_LEARNING_RATE if learning_rate is None else learning_rate
+        self.bit_values = 1 << np.arange(STATE_COUNT)
+
+    @property
+    def weights(self) -> list:
+        return [self.table]
+
+    def get_weights(self) -> list:
+        return [self.table.copy()]
+
+    def set_weights(self, weights: list) -> None:
+        self.table[:] = weights[0]
+
+    def sync(self, model) -> None:
         pass
-    
-    return False
-
-def move_object(obj: GridObject, position: Iterable) -> None:
-    remove_object(obj)
-    add_object(obj, position)
-
-def add_object(obj: GridObject, position: Iterable) -> None:
-    obj.grid_position = position
-    objects[(position[0], position[1])].append(obj)
-
-def remove_object(obj: GridObject) -> None:
-    position = obj.grid_position
-    if obj in objects[(position[0], position[1])]:
-        objects[(position[0], position[1])].remove(obj)
-
-def check_win() -> None:
-    for y in range(GRID_SIZE[1]):
-        for x in range(GRID_SIZE[0]):
-            has_plant = False
-
-            for obj in get_objects_at([x, y]):
-                if isinstance(obj, Plant) and (obj.stage == Plant.STAGE_GROWN or obj.stage == Plant.STAGE_CRUSHED):
-                    has_plant = True
+
+    def save(self, path: str) -> None:
+        np.savez(path, self.table)
+
+    def state_indices(self, states: np.ndarray) -> np.ndarray:
+        return np.asarray(states, dtype=int) @ self.bit_values
+
+    def predict(self, states: np.ndarray, batch_size: int = None) -> np.ndarray:
+        return self.table[self.state_indices(states)]
+
+    def fit(self, states: np.ndarray, targets: np.ndarray, batch_size: int = None, epochs: int = 1, verbose: int = 0, sample_weight: np.ndarray = None) -> None:
+        indices = self.state_indices(states)
+        weights = np.ones(len(indices)) if sample_weight is None else sample_weight
+
+        # Transitions sharing a state pull it towards their weighted mean target
+        # at a rate averaged over the group, so a large batch does not overshoot.
+        # The targets stay fixed across epochs, so all epochs are applied at once.
+        rows, inverse, counts = np.unique(indices, return_inverse=True, return_counts=True)
+        weight_sums = np.bincount(inverse, weights, minlength=len(rows))
+        target_sums = np.zeros((len(rows), ACTION_COUNT))
+        np.add.at(target_sums, inverse, targets * weights[:, None])
+
+        mean_targets = target_sums / np.maximum(weight_sums, 1e-12)[:, None]
+        decay = (1 - self.learning_rate * weight_sums / counts)[:, None] ** epochs
+        self.table[rows] = mean_targets + decay * (self.table[rows] - mean_targets)
+
+def load_policy(weights: list):
+    return QTable(weights) if len(weights) == 1 else NumpyPolicy(weights)
+
+class ReplayMemory(object):
+    COLUMNS = (
+        ("start_states", np.uint8, (STATE_COUNT + 7) // 8),
+        ("end_states", np.uint8, (STATE_COUNT + 7) // 8),
+        ("actions", np.int8, None),
+        ("rewards", np.float32, None),
+        ("completes", np.bool_, None),
+    )
+
+    def __init__(self, capacity: int, path: str = None) -> None:
+        self.capacity = capacity
+        self.path = path
+        self.columns = {}
+        # rows written since the last snapshot
+        self.changed = np.zeros(capacity, dtype=bool)
+
+        if path is None:
+            self.cursor = np.zeros(2, dtype=np.int64)
+            for name, dtype, width in self.COLUMNS:
+                self.columns[name] = np.zeros(self._shape(width), dtype=dtype)
+            return
+
+        os.makedirs(path, exist_ok=True)
+        exists = os.path.exists(os.path.join(path, "cursor.dat"))
+        mode = "r+" if exists else "w+"
+
+        # cursor holds [size, next write index] so a reopened store resumes where it stopped
+        self.cursor = np.memmap(os.path.join(path, "cursor.dat"), dtype=np.int64, mode=mode, shape=(2,))
+        for name, dtype, width in self.COLUMNS:
+            column_path = os.path.join(path, name + ".dat")
+            if exists and os.path.getsize(column_path) != np.dtype(dtype).itemsize * int(np.prod(self._shape(width))):
+                raise ValueError("replay memory at %s was created with a different capacity" % path)
+            self.columns[name] = np.memmap(column_path, dtype=dtype, mode=mode, shape=self._shape(width))
+
+    def _shape(self, width: int) -> tuple:
+        return (self.capacity,) if width is None else (self.capacity, width)
+
+    def __len__(self) -> int:
+        return int(self.cursor[0])
+
+    def extend(self, start_states, end_states, actions, rewards, completes) -> np.ndarray:
+        count = len(actions)
+        if count > self.capacity:
+            start_states, end_states = start_states[-self.capacity:], end_states[-self.capacity:]
+            actions, rewards, completes = actions[-self.capacity:], rewards[-self.capacity:], completes[-self.capacity:]
+            count = self.capacity
+
+        indices = (int(self.cursor[1]) + np.arange(count)) % self.capacity
+        self.columns["start_states"][indices] = np.packbits(np.asarray(start_states, dtype=bool), axis=1)
+        self.columns["end_states"][indices] = np.packbits(np.asarray(end_states, dtype=bool), axis=1)
+        self.columns["actions"][indices] = actions
+        self.columns["rewards"][indices] = rewards
+        self.columns["completes"][indices] = completes
+        self.changed[indices] = True
+
+        self.cursor[1] = (self.cursor[1] + count) % self.capacity
+        self.cursor[0] = min(self.cursor[0] + count, self.capacity)
+        return indices
+
+    def sample(self, batch_size: int) -> tuple:
+        if batch_size >= len(self):
+            indices = np.arange(len(self))
+        else:
+            indices = np.random.randint(0, len(self), batch_size)
+        return self.get(indices)
+
+    def get(self, indices: np.ndarray) -> tuple:
+        return (
+            np.unpackbits(self.columns["start_states"][indices], axis=1, count=STATE_COUNT),
+            np.unpackbits(self.columns["end_states"][indices], axis=1, count=STATE_COUNT),
+            self.columns["actions"][indices].astype(int),
+            self.columns["rewards"][indices].astype(float),
+            self.columns["completes"][indices],
+        )
+
+    def flush(self) -> None:
+        if self.path is not None:
+            self.cursor.flush()
+            for column in self.columns.values():
+                column.flush()
+
+    def snapshot(self) -> dict:
+        # Only the rows written since the previous snapshot are copied, so the
+        # training thread pays for new transitions rather than the whole memory.
+        # The checkpoint writer merges them back into a full copy.
+        if self.path is not None:
+            # memory-mapped columns keep changing on disk, so they can't be resumed from
+            self.flush()
+            return {"cursor": np.array(self.cursor)}
+
+        rows = np.flatnonzero(self.changed)
+        self.changed[rows] = False
+        return {
+            "capacity": self.capacity,
+            "cursor": np.array(self.cursor),
+            "rows": rows,
+            "columns": {name: column[rows] for name, column in self.columns.items()},
+        }
+
+    def restore(self, snapshot: dict) -> None:
+        for name, column in snapshot.get("columns", {}).items():
+            if column.shape != self.columns[name].shape:
+                raise ValueError("checkpoint replay memory holds %d transitions but MEM_SIZE is %d" % (len(column), self.capacity))
+            self.columns[name][:] = column
+        self.cursor[:] = snapshot["cursor"]
+        # the next checkpoint writer starts with nothing, so it needs every row
+        self.changed[:] = True
+
+class SumTree(object):
+    def __init__(self, capacity: int) -> None:
+        self.leaf_count = 1 << max(capacity - 1, 1).bit_length()
+        self.tree = np.zeros(self.leaf_count * 2, dtype=np.float64)
+
+    def total(self) -> float:
+        return self.tree[1]
+
+    def get(self, indices: np.ndarray) -> np.ndarray:
+        return self.tree[np.asarray(indices) + self.leaf_count]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        nodes = np.asarray(indices, dtype=np.int64) + self.leaf_count
+        self.tree[nodes] = priorities
+
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[nodes * 2] + self.tree[nodes * 2 + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+
+        while nodes[0] < self.leaf_count:
+            left = nodes * 2
+            go_right = values >= self.tree[left]
+            values = np.where(go_right, values - self.tree[left], values)
+            nodes = np.where(go_right, left + 1, left)
+
+        return nodes - self.leaf_count
+
+class PrioritizedReplayMemory(ReplayMemory):
+    def __init__(self, capacity: int, path: str = None) -> None:
+        ReplayMemory.__init__(self, capacity, path)
+        self.priorities = SumTree(capacity)
+        self.max_priority = 1.0
+        self.priorities_changed = np.zeros(capacity, dtype=bool)
+
+        if len(self) > 0:
+            self.priorities.update(np.arange(len(self)), np.full(len(self), self.max_priority))
+
+    def extend(self, start_states, end_states, actions, rewards, completes) -> np.ndarray:
+        indices = ReplayMemory.extend(self, start_states, end_states, actions, rewards, completes)
+        self.priorities.update(indices, np.full(len(indices), self.max_priority))
+        self.priorities_changed[indices] = True
+        return indices
+
+    def sample_prioritized(self, batch_size: int, beta: float) -> tuple:
+        size = len(self)
+        total = self.priorities.total()
+
+        segment = total / batch_size
+        values = (np.arange(batch_size) + np.random.random_sample(batch_size)) * segment
+        indices = np.minimum(self.priorities.find(values), size - 1)
+
+        probabilities = self.priorities.get(indices) / total
+        weights = (size * probabilities) ** -beta
+        weights /= np.amax(weights)
+
+        return self.get(indices), indices, weights
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        priorities = (np.abs(td_errors) + PRIORITY_EPSILON) ** PRIORITY_ALPHA
+        self.priorities.update(indices, priorities)
+        self.priorities_changed[indices] = True
+        self.max_priority = max(self.max_priority, float(np.amax(priorities)))
+
+    def snapshot(self) -> dict:
+        snapshot = ReplayMemory.snapshot(self)
+        if "rows" in snapshot:
+            rows = np.flatnonzero(self.priorities_changed)
+            self.priorities_changed[rows] = False
+            snapshot["priority_rows"] = rows
+            snapshot["priority_values"] = self.priorities.get(rows)
+            snapshot["max_priority"] = self.max_priority
+        return snapshot
+
+    def restore(self, snapshot: dict) -> None:
+        ReplayMemory.restore(self, snapshot)
+        if "priorities" in snapshot:
+            self.priorities.tree[:] = snapshot["priorities"]
+            self.max_priority = snapshot["max_priority"]
+            self.priorities_changed[:] = True
+
+class TrajectoryRecorder(object):
+    # Append-only file of chunks, each an int64 row count followed by every
+    # column's rows back to back. A chunk cut short by a crash is dropped on reopen.
+    COLUMNS = (
+        ("start_states", np.uint8, (STATE_COUNT + 7) // 8),
+        ("masks", np.uint8, (ACTION_COUNT + 7) // 8),
+        ("actions", np.int8, None),
+        ("rewards", np.float32, None),
+        ("end_states", np.uint8, (STATE_COUNT + 7) // 8),
+        ("completes", np.bool_, None),
+    )
+
+    def __init__(self, path: str, chunk_size: int = TRAJECTORY_CHUNK_SIZE) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.columns = {}
+        for name, dtype, width in self.COLUMNS:
+            self.columns[name] = np.zeros(self.chunk_shape(chunk_size, width), dtype=dtype)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        length = self.valid_length(path) if os.path.exists(path) else 0
+
+        self.file = open(path, "r+b" if length else "wb")
+        if length:
+            self.file.truncate(length)
+            self.file.seek(length)
+        else:
+            self.file.write(TRAJECTORY_MAGIC)
+
+    @staticmethod
+    def chunk_shape(count: int, width: int) -> tuple:
+        return (count,) if width is None else (count, width)
+
+    @classmethod
+    def chunk_bytes(cls, count: int) -> int:
+        return sum(np.dtype(dtype).itemsize * int(np.prod(cls.chunk_shape(count, width))) for _, dtype, width in cls.COLUMNS)
+
+    @classmethod
+    def valid_length(cls, path: str) -> int:
+        with open(path, "rb") as f:
+            if f.read(len(TRAJECTORY_MAGIC)) != TRAJECTORY_MAGIC:
+                raise ValueError("%s is not a trajectory file" % path)
+
+            end = os.path.getsize(path)
+            length = len(TRAJECTORY_MAGIC)
+            while length + 8 <= end:
+                f.seek(length)
+                count = int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+                if length + 8 + cls.chunk_bytes(count) > end:
                     break
+                length += 8 + cls.chunk_bytes(count)
+            return length
+
+    def record(self, start_states, masks, actions, rewards, end_states, completes) -> None:
+        values = {
+            "start_states": np.packbits(np.asarray(start_states, dtype=bool), axis=1),
+            "masks": np.packbits(np.asarray(masks, dtype=bool), axis=1),
+            "actions": actions,
+            "rewards": rewards,
+            "end_states": np.packbits(np.asarray(end_states, dtype=bool), axis=1),
+            "completes": completes,
+        }
 
-            if not has_plant:
-                return False
-        
-    return True
+        offset = 0
+        while offset < len(actions):
+            count = min(len(actions) - offset, self.chunk_size - self.size)
+            for name, column in self.columns.items():
+                column[self.size:self.size + count] = values[name][offset:offset + count]
+            self.size += count
+            offset += count
 
-def init_grid() -> None:
-    global screen
-    global key_items
-    global font
-    global paused
-    global steps
+            if self.size == self.chunk_size:
+                self.flush()
+
+    def flush(self) -> None:
+        if self.size == 0:
+            return
+
+        self.file.write(np.int64(self.size).tobytes())
+        for name, _, _ in self.COLUMNS:
+            self.file.write(self.columns[name][:self.size].tobytes())
+        self.file.flush()
+        self.size = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+def read_trajectories(path: str) -> Iterable:
+    length = TrajectoryRecorder.valid_length(path)
+
+    with open(path, "rb") as f:
+        f.seek(len(TRAJECTORY_MAGIC))
+        while f.tell() < length:
+            count = int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+
+            columns = {}
+            for name, dtype, width in TrajectoryRecorder.COLUMNS:
+                shape = TrajectoryRecorder.chunk_shape(count, width)
+                columns[name] = np.frombuffer(f.read(np.dtype(dtype).itemsize * int(np.prod(shape))), dtype=dtype).reshape(shape)
+
+            yield (
+                np.unpackbits(columns["start_states"], axis=1, count=STATE_COUNT),
+                np.unpackbits(columns["masks"], axis=1, count=ACTION_COUNT),
+                columns["actions"],
+                columns["rewards"],
+                np.unpackbits(columns["end_states"], axis=1, count=STATE_COUNT),
+                columns["completes"],
+            )
+
+def iterate_minibatches(paths: list, batch_size: int) -> Iterable:
+    pending = []
+    pending_count = 0
+
+    for path in paths:
+        for chunk in read_trajectories(path):
+            pending.append(chunk)
+            pending_count += len(chunk[2])
+
+            while pending_count >= batch_size:
+                batch = [np.concatenate(column) for column in zip(*pending)]
+                yield tuple(column[:batch_size] for column in batch)
+                pending = [tuple(column[batch_size:] for column in batch)]
+                pending_count -= batch_size
+
+    if pending_count:
+        yield tuple(np.concatenate(column) for column in zip(*pending))
+
+class CheckpointWriter(object):
+    def __init__(self, directory: str, keep: int) -> None:
+        # the newest checkpoint is the one a resume needs, so it always stays
+        if keep < 1:
+            raise ValueError("must keep at least 1 checkpoint, got %d" % keep)
+        self.directory = directory
+        self.keep = keep
+        self.pending = queue.Queue()
+        # full replay memory rebuilt from the changed rows each checkpoint carries
+        self.memory = None
+        self.priorities = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, checkpoint: dict) -> None:
+        self.pending.put(checkpoint)
+
+    def close(self) -> None:
+        self.pending.put(None)
+        self.thread.join()
+
+    def _run(self) -> None:
+        running = True
+        while running:
+            # every checkpoint's rows have to be merged, but when several are
+            # waiting only the newest is worth writing
+            checkpoint = None
+            item = self.pending.get()
+            while True:
+                if item is None:
+                    running = False
+                    break
+                item["bot"]["memory"] = self._merge_memory(item["bot"]["memory"])
+                checkpoint = item
+                try:
+                    item = self.pending.get_nowait()
+                except queue.Empty:
+                    break
+
+            if checkpoint is not None:
+                self._write(checkpoint)
+
+    def _merge_memory(self, changes: dict) -> dict:
+        if "rows" not in changes:
+            return changes
+
+        capacity = changes["capacity"]
+        if self.memory is None:
+            self.memory = {"columns": {}}
+            for name, dtype, width in ReplayMemory.COLUMNS:
+                self.memory["columns"][name] = np.zeros((capacity,) if width is None else (capacity, width), dtype=dtype)
+
+        self.memory["cursor"] = changes["cursor"]
+        for name, values in changes["columns"].items():
+            self.memory["columns"][name][changes["rows"]] = values
+
+        if "priority_rows" in changes:
+            if self.priorities is None:
+                self.priorities = SumTree(capacity)
+            if len(changes["priority_rows"]):
+                self.priorities.update(changes["priority_rows"], changes["priority_values"])
+            self.memory["priorities"] = self.priorities.tree
+            self.memory["max_priority"] = changes["max_priority"]
+
+        return self.memory
+
+    def _write(self, checkpoint: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+        path = os.path.join(self.directory, "checkpoint-%06d.pkl" % checkpoint["generation"])
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+        policy_path = os.path.splitext(WEIGHTS_PATH)[0] + ".npz"
+        os.makedirs(os.path.dirname(policy_path) or ".", exist_ok=True)
+        with open(policy_path + ".tmp", "wb") as f:
+            np.savez(f, *checkpoint["bot"]["weights"])
+        os.replace(policy_path + ".tmp", policy_path)
+
+        for old_path in list_checkpoints(self.directory)[:-self.keep]:
+            os.remove(old_path)
+
+class FarmVecEnv(object):
+    def __init__(self, count: int, size: Iterable = None) -> None:
+        self.farms = [Farm(size, 1) for _ in range(count)]
+        self.masks = np.zeros((count, ACTION_COUNT), dtype=np.int8)
+        self.episode_steps = np.zeros(count, dtype=int)
+
+    def __len__(self) -> int:
+        return len(self.farms)
+
+    def reset(self) -> tuple:
+        for f in self.farms:
+            f.reset()
+        return self._observe()
+
+    def step(self, actions: np.ndarray) -> tuple:
+        rewards = np.zeros(len(self.farms), dtype=float)
+        dones = np.zeros(len(self.farms), dtype=bool)
+
+        for i, f in enumerate(self.farms):
+            rewards[i] = f.do_action(actions[i], self.masks[i])
+            dones[i] = f.check_win()
+
+        # Finished farms are observed before they reset, so their end states
+        # are the terminal ones; the states to act from next are the new
+        # episodes' first states.
+        end_states, masks = self._observe()
+        states = end_states
+        if dones.any():
+            states = end_states.copy()
+            for i in np.flatnonzero(dones):
+                f = self.farms[i]
+                self.episode_steps[i] = f.steps
+                f.reset()
+                states[i] = STATE_FEATURES[f.get_state_bits()]
+                masks[i] = ACTION_MASKS[f.get_action_bits()]
+
+        return end_states, states, masks, rewards, dones
+
+    def _observe(self) -> tuple:
+        states = STATE_FEATURES[[f.get_state_bits() for f in self.farms]]
+        self.masks = ACTION_MASKS[[f.get_action_bits() for f in self.farms]]
+        return states, self.masks
+
+def list_checkpoints(directory: str) -> list:
+    return sorted(glob.glob(os.path.join(directory, "checkpoint-*.pkl")))
+
+def make_checkpoint(bot: Bot) -> dict:
+    return {
+        "generation": generation,
+        "bot": bot.snapshot(),
+        "python_random": random.getstate(),
+        "numpy_random": np.random.get_state(),
+    }
+
+def restore_checkpoint(bot: Bot, checkpoint: dict) -> None:
     global generation
 
-    generation += 1
-    steps = 0
-    paused = False
+    generation = checkpoint["generation"]
+    bot.restore(checkpoint["bot"])
+    random.setstate(checkpoint["python_random"])
+    np.random.set_state(checkpoint["numpy_random"])
+
+def save_checkpoint(bot: Bot) -> None:
+    started = profiler.start()
+    if checkpoint_writer is not None:
+        checkpoint_writer.submit(make_checkpoint(bot))
+    profiler.stop("checkpoint", started)
+
+def start_checkpointing(bot: Bot) -> None:
+    global checkpoint_writer
 
-    objects.clear()
-    for y in range(GRID_SIZE[1]):
-        for x in range(GRID_SIZE[0]):
-            objects[(x, y)] = []
+    if RESUME and REPLAY_PATH is not None:
+        # its columns have been overwritten since the checkpoint was taken
+        raise ValueError("a memory-mapped replay memory can't be resumed from a checkpoint, drop --replay-path or --resume")
+
+    checkpoint_writer = CheckpointWriter(CHECKPOINT_DIR, CHECKPOINT_KEEP)
+
+    if RESUME:
+        checkpoints = list_checkpoints(CHECKPOINT_DIR)
+        if not checkpoints:
+            print("no checkpoint in %s, starting from scratch" % CHECKPOINT_DIR)
+            return
+
+        with open(checkpoints[-1], "rb") as f:
+            restore_checkpoint(bot, pickle.load(f))
+        print("resumed from %s at generation %d" % (checkpoints[-1], generation))
+
+def stop_checkpointing() -> None:
+    global checkpoint_writer
+
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+        checkpoint_writer = None
+
+def record_transitions(start_states, masks, actions, rewards, end_states, completes) -> None:
+    if trajectory_recorder is not None:
+        trajectory_recorder.record(start_states, masks, actions, rewards, end_states, completes)
+
+def start_recording() -> None:
+    global trajectory_recorder
+
+    if RECORD_PATH is not None:
+        trajectory_recorder = TrajectoryRecorder(RECORD_PATH)
+
+def stop_recording() -> None:
+    global trajectory_recorder
+
+    if trajectory_recorder is not None:
+        trajectory_recorder.close()
+        trajectory_recorder = None
+
+def solve_farm(size: Iterable = None, max_states: int = None) -> tuple:
+    # A* over whole-world states, with successors taken from the farm's own
+    # action rules and memoized. Returns one optimal path from the starting
+    # farm, its actions and the worlds they start from, not an action for
+    # every state. None when the farm has more than SOLVER_MAX_CELLS cells or
+    # more than max_states states need expanding.
+    max_states = SOLVER_MAX_STATES if max_states is None else max_states
+    solver_farm = Farm(size, 1)
+    if solver_farm.area > SOLVER_MAX_CELLS:
+        return None
+    start = solver_farm.get_world()
+    transitions = {}
+    parents = {start: None}
+    costs = {start: 0}
+    frontier = [(solver_farm.remaining_steps_bound(), 0, start)]
+    expanded = 0
+
+    while frontier:
+        _, cost, world = heapq.heappop(frontier)
+        cost = -cost
+        if cost > costs[world]:
+            continue
+
+        solver_farm.set_world(world)
+        if solver_farm.check_win():
+            actions, worlds = [], []
+            while parents[world] is not None:
+                world, action = parents[world]
+                actions.append(action)
+                worlds.append(world)
+            return actions[::-1], worlds[::-1], expanded
+
+        expanded += 1
+        if expanded > max_states:
+            return None
+
+        if world not in transitions:
+            successors = []
+            mask = solver_farm.get_available_actions()
+            for action in np.flatnonzero(mask):
+                solver_farm.set_world(world)
+                solver_farm.do_action(int(action), mask)
+                successors.append((int(action), solver_farm.get_world(), solver_farm.remaining_steps_bound()))
+            transitions[world] = successors
+
+        for action, next_world, bound in transitions[world]:
+            if costs.get(next_world, cost + 2) > cost + 1:
+                costs[next_world] = cost + 1
+                parents[next_world] = (world, action)
+                # ties go to the deeper state, which is closer to a finished farm
+                heapq.heappush(frontier, (cost + 1 + bound, -(cost + 1), next_world))
+
+    return None
+
+def pretrain_bot(bot: Bot, epochs: int = None) -> None:
+    solution = solve_farm()
+    if solution is None:
+        print("farm too large to solve, skipping pretraining")
+        return
+
+    # only the states along one optimal path are fitted, and the 8-bit state
+    # maps many of them onto the same row
+    actions, worlds, _ = solution
+    solver_farm = Farm(bot_count=1)
+    states = np.zeros((len(worlds), STATE_COUNT), dtype=np.int8)
+    rewards = np.zeros(len(worlds))
+    for i, world in enumerate(worlds):
+        solver_farm.set_world(world)
+        states[i] = solver_farm.get_state()
+        rewards[i] = solver_farm.do_action(actions[i], solver_farm.get_available_actions())
+
+    # the discounted return of following the solution, which is what the
+    # learner's bootstrapped targets converge to for the optimal actions
+    returns = np.zeros(len(worlds))
+    future = 0.0
+    for i in reversed(range(len(worlds))):
+        future = rewards[i] + GAMMA * future
+        returns[i] = future
+
+    targets = bot.predict(states)
+    targets[np.arange(len(actions)), actions] = returns
+    bot.fit(states, targets, PRETRAIN_EPOCHS if epochs is None else epochs)
+    bot.sync_target()
+    print("pretrained on an optimal solution of %d steps" % len(actions))
+
+def warm_start(bot: Bot) -> None:
+    if PRETRAIN:
+        pretrain_bot(bot)
+
+def epsilon_greedy(states: np.ndarray, masks: np.ndarray, epsilon: float, predict, q_values: np.ndarray = None) -> np.ndarray:
+    count = len(states)
+    explore = np.random.randint(0, 2, count) < epsilon
+
+    actions = np.argmax(np.random.random_sample(masks.shape) * masks, axis=1)
+
+    if not explore.all():
+        if q_values is None:
+            q_values = predict(states)
+        actions = np.where(explore, actions, np.argmax(q_values, axis=1))
+
+    return actions
+
+def _decode_name(name) -> str:
+    return name.decode("utf8") if isinstance(name, bytes) else name
+
+def get_image(path: str) -> pygame.Surface:
+    image = asset_images.get(path)
+    if image is None:
+        image = pygame.image.load(path)
+        if pygame.display.get_surface() is not None:
+            image = image.convert_alpha()
+        asset_images[path] = image
+    return image
+
+def get_font(path: str = FONT_PATH, size: int = FONT_SIZE) -> pygame.font.Font:
+    font = asset_fonts.get((path, size))
+    if font is None:
+        font = pygame.font.Font(path, size)
+        asset_fonts[(path, size)] = font
+    return font
+
+def get_glyph(text: str, color: Iterable) -> pygame.Surface:
+    key = (text, tuple(color))
+    glyph = asset_glyphs.get(key)
+    if glyph is None:
+        glyph = get_font().render(text, False, pygame.Color(*color))
+        asset_glyphs[key] = glyph
+    return glyph
+
+def preload_assets() -> None:
+    for obj_type in (Bot, Hoe, Seeds, Water):
+        get_image(obj_type.image_path)
+
+    for stage in Plant.STAGE_ASSETS:
+        Plant.get_stage_surface(stage)
+        Plant.get_stage_glyph(stage)
+
+def draw_surface(surface: pygame.Surface, position: Iterable) -> None:
+    screen.blit(surface, position - view_origin * CELL_SIZE)
+
+def get_view_size() -> np.ndarray:
+    return np.minimum(GRID_SIZE, VIEW_CELLS)
+
+def get_view_contents(start: np.ndarray, end: np.ndarray, bots: list) -> dict:
+    # (plant stage, ground items, items held by the bots here or None) per non-empty cell
+    contents = {}
+    for cell, stage in farm.get_plants_in(start, end):
+        contents[cell] = (stage, NO_ITEM, None)
+
+    for cell, items in farm.item_cells.items():
+        if start[0] <= cell[0] < end[0] and start[1] <= cell[1] < end[1]:
+            contents[cell] = (contents.get(cell, EMPTY_CELL)[0], items, None)
+
+    for cell, holding in bots:
+        stage, items, held = contents.get(cell, EMPTY_CELL)
+        contents[cell] = (stage, items, (held or ()) + (holding,))
+    return contents
+
+def draw_cell(cell: tuple, contents: tuple) -> None:
+    stage, items, _ = contents
+    if stage != NO_PLANT:
+        draw_surface(Plant.get_stage_surface(stage), np.array(cell) * CELL_SIZE)
+
+    for name in ("hoe", "seeds", "water"):
+        item = key_items[name]
+        if items & item.item_flag:
+            item.grid_position = np.array(cell)
+            item._draw()
+
+def draw_bot(position: Iterable, holding: int) -> None:
+    draw_surface(key_items["bot"].image, np.array(position) * CELL_SIZE)
+    if holding != NO_ITEM:
+        held = key_items[ITEM_NAMES[holding]]
+        if held.image:
+            draw_surface(held.image, np.array(position) * CELL_SIZE + np.array([8, 0]))
+
+def take_snapshot() -> tuple:
+    # everything draw_world needs, copied out of the farm so it can be drawn
+    # while the simulation keeps running
+    view_size = get_view_size()
+    bots = farm.get_bots()
+    origin = np.clip(np.array(bots[0][0]) - view_size // 2, 0, farm.size - view_size)
+    # bots are drawn left to right, so how they overlap doesn't depend on
+    # which bot is which
+    bots.sort()
+    return origin, get_view_contents(origin, origin + view_size, bots), bots
+
+def draw_world(snapshot: tuple = None) -> list:
+    global view_origin
+    global drawn_cells
+
+    # on grids larger than the window the view follows the first bot
+    origin, contents, bots = take_snapshot() if snapshot is None else snapshot
+
+    if drawn_cells is None or not np.array_equal(origin, view_origin):
+        view_origin = origin
+        screen.fill(clear_color)
+        for cell, cell_contents in contents.items():
+            draw_cell(cell, cell_contents)
+        for cell, holding in bots:
+            draw_bot(cell, holding)
+        drawn_cells = contents
+        return [screen.get_rect()]
+
+    dirty_cells = set(cell for cell in drawn_cells.keys() | contents.keys() if drawn_cells.get(cell) != contents.get(cell))
+
+    # The held item hangs over into the cell right of the bot, so redrawing a
+    # cell with a bot redraws its right neighbour and redrawing a cell redraws
+    # the bot to its left. Bots in a row pass that on until it settles.
+    def has_bot(cell: tuple) -> bool:
+        return drawn_cells.get(cell, EMPTY_CELL)[2] is not None or contents.get(cell, EMPTY_CELL)[2] is not None
+
+    pending = list(dirty_cells)
+    while pending:
+        cell = pending.pop()
+        left = (cell[0] - 1, cell[1])
+        right = (cell[0] + 1, cell[1])
+        for neighbour, linked in ((right, has_bot(cell)), (left, has_bot(left))):
+            if linked and neighbour not in dirty_cells:
+                dirty_cells.add(neighbour)
+                pending.append(neighbour)
+
+    rects = []
+    for cell in dirty_cells:
+        rect = pygame.Rect(tuple((np.array(cell) - view_origin) * CELL_SIZE), tuple(CELL_SIZE))
+        screen.fill(clear_color, rect)
+        rects.append(rect)
+
+    for cell in dirty_cells:
+        if cell in contents:
+            draw_cell(cell, contents[cell])
+    for cell, holding in bots:
+        if cell in dirty_cells:
+            draw_bot(cell, holding)
+
+    drawn_cells = contents
+    return rects
+
+def render_due(steps_since_render: int, since_render: float) -> bool:
+    if RENDER_EVERY_STEPS > 0:
+        return steps_since_render >= RENDER_EVERY_STEPS
+    return RENDER_FPS <= 0 or since_render >= 1.0 / RENDER_FPS
+
+def init_display() -> None:
+    global screen
+    global drawn_cells
 
     pygame.init()
-    icon = pygame.image.load("icon.png")
-    pygame.display.set_icon(icon)
+    pygame.display.set_icon(get_image("icon.png"))
     pygame.display.set_caption("Machine Learning Farming")
-    font = pygame.font.Font("kenney_pixel_square.ttf", 16)
 
-    screen = pygame.display.set_mode((GRID_SIZE[0] * 16, GRID_SIZE[1] * 16), pygame.RESIZABLE | pygame.SCALED)
+    screen = pygame.display.set_mode(tuple(get_view_size() * CELL_SIZE), pygame.RESIZABLE | pygame.SCALED)
+    drawn_cells = None
+
+    preload_assets()
+
+def init_grid() -> None:
+    global farm
+    global generation
 
-    add_object(key_items["bot"], np.array([GRID_SIZE[0]-1, GRID_SIZE[1]/2], dtype=int))
-    add_object(key_items["hoe"], np.array([GRID_SIZE[0]/2, 0], dtype=int))
-    add_object(key_items["seeds"], np.array([GRID_SIZE[0]/2, GRID_SIZE[1]-1], dtype=int))
-    add_object(key_items["water"], np.array([0, GRID_SIZE[1]/2], dtype=int))
+    generation += 1
+
+    if farm is None:
+        farm = Farm()
+    farm.reset()
 
 def init_key_items() -> None:
     key_items["bot"] = Bot()
@@ -579,49 +1698,459 @@ def init_key_items() -> None:
     key_items["seeds"] = Seeds()
     key_items["water"] = Water()
 
-def main() -> None:
-    global screen
-    global steps
-    global key_items
-    global font
-    global paused
+def train_vectorized(env_count: int) -> None:
+    global generation
+
+    bot = Bot()
+    env = FarmVecEnv(env_count)
+
+    states, masks = env.reset()
+    generation += 1
+    warm_start(bot)
+    start_checkpointing(bot)
+    start_recording()
+
+    try:
+        while generation < GENERATIONS - 1:
+            bot.epsilon = 1 - (generation * EPSILON_DECAY)
+
+            started = profiler.start()
+            actions = bot.choose_actions(states, masks, bot.next_q)
+            profiler.stop("act", started)
+
+            started = profiler.start()
+            end_states, next_states, next_masks, rewards, dones = env.step(actions)
+            profiler.stop("step", started)
+            profiler.count("steps", env_count)
+            profiler.count("invalid_actions", int(env_count - np.sum(masks[np.arange(env_count), actions])))
+
+            record_transitions(states, masks, actions, rewards, end_states, dones)
+            bot.learn(states, end_states, actions, rewards, dones)
+
+            if dones.any():
+                for i in np.flatnonzero(dones):
+                    print(env.episode_steps[i])
+                    profiler.end_generation(generation)
+                    generation += 1
+                bot._redo_memory()
+                save_checkpoint(bot)
+
+            states, masks = next_states, next_masks
+            profiler.maybe_log()
+    finally:
+        stop_checkpointing()
+        stop_recording()
+
+def run_actor(actor_id: int, settings: dict, weights: list, weights_queue, transition_queue, generation_value, stop_event, chunk_size: int, seed: int) -> None:
+    configure(settings)
+    random.seed(seed)
+    np.random.seed(seed)
+
+    policy = load_policy(weights)
+    actor_farm = Farm(bot_count=1)
+
+    while not stop_event.is_set():
+        states = np.zeros((chunk_size, STATE_COUNT), dtype=np.int8)
+        masks = np.zeros((chunk_size, ACTION_COUNT), dtype=np.int8)
+        end_states = np.zeros((chunk_size, STATE_COUNT), dtype=np.int8)
+        actions = np.zeros(chunk_size, dtype=int)
+        rewards = np.zeros(chunk_size, dtype=float)
+        dones = np.zeros(chunk_size, dtype=bool)
+        episodes = []
+
+        epsilon = 1 - (generation_value.value * EPSILON_DECAY)
+
+        for i in range(chunk_size):
+            mask = actor_farm.get_available_actions()
+            masks[i] = mask
+            states[i] = actor_farm.get_state()
+
+            actions[i] = epsilon_greedy(states[i:i+1], mask.reshape((1, ACTION_COUNT)), epsilon, policy.predict)[0]
+            rewards[i] = actor_farm.do_action(actions[i], mask)
+            end_states[i] = actor_farm.get_state()
+            dones[i] = actor_farm.check_win()
+
+            if dones[i]:
+                episodes.append(actor_farm.steps)
+                actor_farm.reset()
+
+        chunk = (actor_id, states, masks, end_states, actions, rewards, dones, episodes)
+        while not stop_event.is_set():
+            try:
+                transition_queue.put(chunk, timeout=0.1)
+                break
+            except queue.Full:
+                pass
 
+        try:
+            while True:
+                policy = load_policy(weights_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+    transition_queue.cancel_join_thread()
+
+def publish_latest(latest_queue, item) -> None:
+    try:
+        latest_queue.get_nowait()
+    except queue.Empty:
+        pass
+
+    try:
+        latest_queue.put_nowait(item)
+    except queue.Full:
+        pass
+
+def train_distributed(actor_count: int = ACTOR_COUNT, sync_interval: int = WEIGHT_SYNC_INTERVAL, queue_depth: int = ACTOR_QUEUE_DEPTH) -> None:
+    global generation
+
+    context = multiprocessing.get_context("spawn")
+
+    bot = Bot()
+    generation += 1
+    warm_start(bot)
+    start_checkpointing(bot)
+    start_recording()
+
+    transition_queue = context.Queue(maxsize=queue_depth)
+    weights_queues = [context.Queue(maxsize=1) for _ in range(actor_count)]
+    generation_value = context.Value("i", generation)
+    stop_event = context.Event()
+
+    actors = []
+    for i in range(actor_count):
+        settings = dict((name, globals()[name]) for name in ACTOR_SETTINGS)
+        actor = context.Process(target=run_actor, args=(i, settings, bot.model.get_weights(), weights_queues[i], transition_queue,
+            generation_value, stop_event, ACTOR_CHUNK_SIZE, random.randrange(2**31)), daemon=True)
+        actor.start()
+        actors.append(actor)
+
+    received = np.zeros(actor_count, dtype=int)
+    since_sync = 0
+    start_time = time.perf_counter()
+    report_time = start_time
+
+    try:
+        while generation < GENERATIONS - 1:
+            actor_id, states, masks, end_states, actions, rewards, dones, episodes = transition_queue.get()
+            received[actor_id] += len(states)
+            profiler.count("steps", len(states))
+
+            record_transitions(states, masks, actions, rewards, end_states, dones)
+            bot.learn(states, end_states, actions, rewards, dones)
+
+            if episodes:
+                for episode_steps in episodes:
+                    print(episode_steps)
+                    profiler.end_generation(generation)
+                    generation += 1
+                generation_value.value = generation
+                bot._redo_memory()
+                save_checkpoint(bot)
+
+            since_sync += len(states)
+            if since_sync >= sync_interval:
+                since_sync = 0
+                # a copy, the queues pickle it later while training goes on
+                weights = bot.model.get_weights()
+                for weights_queue in weights_queues:
+                    publish_latest(weights_queue, weights)
+
+            now = time.perf_counter()
+            if now - report_time >= ACTOR_REPORT_INTERVAL:
+                report_time = now
+                rates = received / (now - start_time)
+                print("transitions/s per actor: " + ", ".join("%d: %.0f" % (i, r) for i, r in enumerate(rates)))
+
+            profiler.maybe_log()
+    finally:
+        stop_event.set()
+        while any(actor.is_alive() for actor in actors):
+            try:
+                transition_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for actor in actors:
+            actor.join()
+        stop_checkpointing()
+        stop_recording()
+
+def train_offline(paths: list, batch_size: int = OFFLINE_BATCH_SIZE, epochs: int = OFFLINE_EPOCHS) -> None:
+    bot = Bot()
+
+    for epoch in range(epochs):
+        bot.sync_target()
+        transitions = 0
+        td_error_total = 0.0
+        start = time.perf_counter()
+
+        for start_states, masks, actions, rewards, end_states, completes in iterate_minibatches(paths, batch_size):
+            targets, _, td_errors = bot._compute_targets(start_states, end_states, actions, rewards, completes)
+            bot.fit(start_states, targets, 1)
+            transitions += len(actions)
+            td_error_total += float(np.sum(np.abs(td_errors)))
+
+        elapsed = time.perf_counter() - start
+        print("epoch %d: %d transitions, mean |td error| %.3f, %.0f transitions/s" % (
+            epoch, transitions, td_error_total / max(transitions, 1), transitions / max(elapsed, 1e-9)))
+
+    bot.save_weights()
+
+def greedy_action(policy, rollout_farm: Farm) -> int:
+    mask = rollout_farm.get_available_actions()
+    q = policy.predict(rollout_farm.get_state().reshape((1, STATE_COUNT)))[0]
+    return int(np.argmax(np.where(mask, q, -np.inf)))
+
+def rollout(policy, rollout_farm: Farm, max_steps: int) -> float:
+    # discounted reward of following the greedy policy from the current world
+    total = 0.0
+    discount = 1.0
+    for i in range(max_steps):
+        if rollout_farm.check_win():
+            break
+        total += discount * rollout_farm.do_action(greedy_action(policy, rollout_farm), rollout_farm.get_available_actions())
+        discount *= GAMMA
+    return total
+
+def plan_action(policy, rollout_farm: Farm, depth: int) -> int:
+    # try every valid action, follow the policy for depth more steps after it
+    # and keep the action with the best return, then put the world back
+    start = rollout_farm.snapshot()
+    mask = rollout_farm.get_available_actions()
+    returns = np.full(ACTION_COUNT, -np.inf)
+    for action in np.flatnonzero(mask):
+        reward = rollout_farm.do_action(action, mask)
+        returns[action] = reward + GAMMA * rollout(policy, rollout_farm, depth)
+        rollout_farm.restore(start)
+    return int(np.argmax(returns))
+
+def evaluate(weights_path: str, episodes: int, max_steps: int = 1000, lookahead: int = 0) -> list:
+    policy = load_policy(NumpyPolicy.read_weights(weights_path))
+    eval_farm = Farm(bot_count=1)
+
+    results = []
+    for episode in range(episodes):
+        eval_farm.reset()
+        while not eval_farm.check_win() and eval_farm.steps < max_steps:
+            action = plan_action(policy, eval_farm, lookahead) if lookahead > 0 else greedy_action(policy, eval_farm)
+            eval_farm.do_action(action, eval_farm.get_available_actions())
+
+        results.append(eval_farm.steps if eval_farm.check_win() else None)
+        print("episode %d: %s" % (episode, results[-1] if results[-1] is not None else "not finished after %d steps" % max_steps))
+
+    return results
+
+def print_solution(size: Iterable = None) -> None:
+    start = time.perf_counter()
+    solution = solve_farm(size)
+    if solution is None:
+        print("no solution within %d cells and %d expanded states" % (SOLVER_MAX_CELLS, SOLVER_MAX_STATES))
+        return
+
+    actions, _, expanded = solution
+    names = dict((value, name) for name, value in vars(Bot).items() if name.isupper() and isinstance(value, int))
+    print("optimal: %d steps (%d states expanded in %.1f s)" % (len(actions), expanded, time.perf_counter() - start))
+    print(" ".join(names[action] for action in actions))
+
+def measure_step_latency(step_count: int) -> float:
     init_key_items()
     init_grid()
 
-    frame_ticks_last = pygame.time.get_ticks()
+    bot = key_items["bot"]
+    start = time.perf_counter()
+    for i in range(step_count):
+        bot._update(0)
+    latency = (time.perf_counter() - start) / step_count
 
-    running = True
+    print("%d steps, %.3f ms per step" % (step_count, latency * 1000))
+    return latency
+
+def simulate(stop_event: threading.Event, snapshot_request: threading.Event, snapshots: queue.Queue) -> None:
+    frame_time_last = time.perf_counter()
+
+    while not stop_event.is_set() and generation < GENERATIONS - 1:
+        frame_time = time.perf_counter()
+        delta_time = frame_time - frame_time_last
+        frame_time_last = frame_time
+
+        for obj in list(key_items.values()):
+            obj._update(delta_time)
 
-    while running:
-        frame_ticks = pygame.time.get_ticks()
-        delta_time = (frame_ticks - frame_ticks_last) / 1000.0
-        frame_ticks_last = frame_ticks
-
-        for i in range(SKIP_STEPS):
-            if not paused:
-                for key in objects.keys():
-                    for obj in objects[key]:
-                        obj._update(delta_time)
-            
-            steps += 1
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-
-            for key in objects.keys():
-                for obj in objects[key]:
+        if snapshot_request.is_set():
+            snapshot_request.clear()
+            publish_latest(snapshots, take_snapshot())
+
+        profiler.maybe_log()
+
+def render_threaded() -> None:
+    global drawn_cells
+
+    stop_event = threading.Event()
+    snapshot_request = threading.Event()
+    snapshots = queue.Queue(maxsize=1)
+    worker = threading.Thread(target=simulate, args=(stop_event, snapshot_request, snapshots), daemon=True)
+    clock = pygame.time.Clock()
+
+    snapshot_request.set()
+    worker.start()
+
+    try:
+        while worker.is_alive():
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return
+                elif event.type in (pygame.VIDEOEXPOSE, pygame.VIDEORESIZE):
+                    drawn_cells = None
+
+                for obj in key_items.values():
                     obj._input(event)
-            
-        screen.fill(clear_color)
-        for key in objects.keys():
-            for obj in objects[key]:
-                obj._draw()
-        pygame.display.update()
 
-        if generation >= GENERATIONS - 1:
-            break
+            try:
+                snapshot = snapshots.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                started = profiler.start()
+                pygame.display.update(draw_world(snapshot))
+                profiler.stop("render", started)
+                snapshot_request.set()
+
+            clock.tick(RENDER_FPS)
+    finally:
+        stop_event.set()
+        worker.join()
+
+def main(headless_mode: bool = False, threaded: bool = False) -> None:
+    global headless
+    global drawn_cells
+
+    headless = headless_mode
+    if not headless:
+        init_display()
+
+    init_key_items()
+    init_grid()
+    warm_start(key_items["bot"])
+    start_checkpointing(key_items["bot"])
+    start_recording()
+
+    frame_time_last = time.perf_counter()
+    render_time_last = 0.0
+    events_time_last = 0.0
+    steps_since_render = 0
+
+    running = True
+
+    try:
+        if threaded and not headless:
+            render_threaded()
+            return
+
+        while running:
+            frame_time = time.perf_counter()
+            delta_time = frame_time - frame_time_last
+            frame_time_last = frame_time
+
+            for obj in list(key_items.values()):
+                obj._update(delta_time)
+            steps_since_render += 1
+
+            # events don't wait for the next frame, so the window stays
+            # responsive when frames are drawn only every few steps
+            if not headless and frame_time - events_time_last >= EVENT_INTERVAL:
+                events_time_last = frame_time
+
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        running = False
+                    elif event.type in (pygame.VIDEOEXPOSE, pygame.VIDEORESIZE):
+                        drawn_cells = None
+
+                    for obj in key_items.values():
+                        obj._input(event)
+
+            if running and not headless and render_due(steps_since_render, frame_time - render_time_last):
+                render_time_last = frame_time
+                steps_since_render = 0
+
+                started = profiler.start()
+                pygame.display.update(draw_world())
+                profiler.stop("render", started)
+
+            profiler.maybe_log()
+
+            if generation >= GENERATIONS - 1:
+                break
+    finally:
+        stop_checkpointing()
+        stop_recording()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Machine Learning Farming")
+    parser.add_argument("--headless", action="store_true", help="train without opening a window or loading assets")
+    parser.add_argument("--grid-size", type=parse_grid_size, default=tuple(GRID_SIZE), metavar="WxH", help="farm size in cells, e.g. 100x100")
+    parser.add_argument("--fps", type=float, default=RENDER_FPS, help="target frames per second of the window; 0 draws after every step")
+    parser.add_argument("--render-every", type=int, default=RENDER_EVERY_STEPS, metavar="STEPS", help="draw after every STEPS simulation steps instead of at a target frame rate")
+    parser.add_argument("--threaded", action="store_true", help="train in a worker thread and draw its snapshots from the main thread")
+    parser.add_argument("--bots", type=int, default=BOT_COUNT, help="bots sharing each farm and one policy")
+    parser.add_argument("--envs", type=int, default=1, help="number of farms to step in lockstep (runs headless when > 1)")
+    parser.add_argument("--backend", choices=("network", "table"), default=POLICY_BACKEND, help="learn Q values with the Keras network or a NumPy Q-table")
+    parser.add_argument("--memory-size", type=int, default=MEM_SIZE, help="replay memory capacity in transitions")
+    parser.add_argument("--replay-path", help="directory for a memory-mapped replay memory that persists across runs")
+    parser.add_argument("--train-every", type=int, default=TRAIN_EVERY_STEPS, metavar="STEPS", help="environment steps between replay batch updates; 0 fits every step for %d epochs instead" % TRAIN_SHORT_EPOCHS)
+    parser.add_argument("--train-batch-size", type=int, default=TRAIN_BATCH_SIZE, help="transitions sampled per replay batch update")
+    parser.add_argument("--target-sync", type=int, default=TARGET_SYNC_STEPS, metavar="STEPS", help="environment steps between target network syncs; 0 bootstraps from the network being trained")
+    parser.add_argument("--prioritized", action="store_true", help="sample replay by TD error from a sum tree")
+    parser.add_argument("--actors", type=int, default=0, help="train with this many actor processes feeding one learner")
+    parser.add_argument("--sync-interval", type=int, default=WEIGHT_SYNC_INTERVAL, help="transitions the learner consumes between weight broadcasts to actors")
+    parser.add_argument("--queue-depth", type=int, default=ACTOR_QUEUE_DEPTH, help="transition chunks that may wait for the learner")
+    parser.add_argument("--profile", action="store_true", help="time each phase of the loop and log a summary periodically")
+    parser.add_argument("--profile-csv", metavar="PATH", help="append one row of phase timings and counters per generation to this CSV file")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="directory the background writer saves checkpoints to after each generation")
+    parser.add_argument("--keep-checkpoints", type=int, default=CHECKPOINT_KEEP, help="number of most recent checkpoints to keep, at least 1")
+    parser.add_argument("--resume", action="store_true", help="continue training from the latest checkpoint in --checkpoint-dir")
+    parser.add_argument("--record", metavar="PATH", help="append every transition to this trajectory file")
+    parser.add_argument("--train-offline", nargs="+", metavar="PATH", help="train on recorded trajectory files without running the farm")
+    parser.add_argument("--offline-batch-size", type=int, default=OFFLINE_BATCH_SIZE, help="transitions per minibatch with --train-offline")
+    parser.add_argument("--offline-epochs", type=int, default=OFFLINE_EPOCHS, help="passes over the recorded files with --train-offline")
+    parser.add_argument("--solve", action="store_true", help="print the optimal number of steps and one optimal action sequence for farms of up to %d cells, then exit" % SOLVER_MAX_CELLS)
+    parser.add_argument("--pretrain", action="store_true", help="fit the bot to the returns along one optimal solution before training (farms of up to %d cells)" % SOLVER_MAX_CELLS)
+    parser.add_argument("--evaluate", metavar="WEIGHTS", help="run the greedy policy from an .npz or .hdf5 weights file without TensorFlow")
+    parser.add_argument("--episodes", type=int, default=10, help="episodes to play with --evaluate")
+    parser.add_argument("--lookahead", type=int, default=0, metavar="STEPS", help="with --evaluate, pick each action by rolling the policy out this many steps after every valid action")
+    parser.add_argument("--measure-latency", type=int, default=0, metavar="STEPS", help="time this many headless steps and exit")
+    args = parser.parse_args()
+
+    GRID_SIZE = np.array(args.grid_size, dtype=int)
+    BOT_COUNT = args.bots
+    RENDER_FPS = args.fps
+    RENDER_EVERY_STEPS = args.render_every
+    POLICY_BACKEND = args.backend
+    MEM_SIZE = args.memory_size
+    REPLAY_PATH = args.replay_path
+    PRIORITIZED_REPLAY = args.prioritized
+    TRAIN_EVERY_STEPS = args.train_every
+    TRAIN_BATCH_SIZE = args.train_batch_size
+    TARGET_SYNC_STEPS = args.target_sync
+    CHECKPOINT_DIR = args.checkpoint_dir
+    CHECKPOINT_KEEP = args.keep_checkpoints
+    RESUME = args.resume
+    RECORD_PATH = args.record
+    PRETRAIN = args.pretrain
+    profiler.enabled = args.profile or args.profile_csv is not None
+    profiler.csv_path = args.profile_csv
+
+    if args.solve:
+        print_solution()
+    elif args.evaluate:
+        evaluate(args.evaluate, args.episodes, lookahead=args.lookahead)
+    elif args.train_offline:
+        train_offline(args.train_offline, args.offline_batch_size, args.offline_epochs)
+    elif args.measure_latency > 0:
+        measure_step_latency(args.measure_latency)
+    elif args.actors > 0:
+        train_distributed(args.actors, args.sync_interval, args.queue_depth)
+    elif args.envs > 1:
+        train_vectorized(args.envs)
+    else:
+        main(headless_mode=args.headless, threaded=args.threaded)
@@ -0,0 +1,170 @@
+import argparse
+import contextlib
+import csv
+import io
+import itertools
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+
+import main_loop
+
+def parse_value(text: str):
+    for cast in (int, float):
+        try:
+            return cast(text)
+        except ValueError:
+            pass
+    return text
+
+def parse_param(text: str) -> tuple:
+    # NAME=a,b,c lists values, NAME=low:high is a range for random search
+    name, values = text.split("=", 1)
+    name = name.strip().upper()
+    if ":" in values:
+        low, high = values.split(":")
+        return name, (parse_value(low), parse_value(high))
+    return name, [parse_value(value) for value in values.split(",")]
+
+def grid_configs(params: dict) -> list:
+    for name, values in params.items():
+        if isinstance(values, tuple):
+            raise ValueError("%s is a range, which needs --random" % name)
+
+    names = list(params)
+    return [dict(zip(names, values)) for values in itertools.product(*(params[name] for name in names))]
+
+def random_configs(params: dict, count: int, rng: random.Random) -> list:
+    configs = []
+    for i in range(count):
+        config = {}
+        for name, values in params.items():
+            if not isinstance(values, tuple):
+                config[name] = rng.choice(values)
+            elif isinstance(values[0], int) and isinstance(values[1], int):
+                config[name] = rng.randint(values[0], values[1])
+            else:
+                config[name] = rng.uniform(values[0], values[1])
+        configs.append(config)
+    return configs
+
+def derived_settings(config: dict, generations: int = None) -> dict:
+    # keep the relations the module sets up at import time, with epsilon and
+    # the priority schedule spread over the generations a run actually lasts
+    settings = dict(config)
+    if generations is not None:
+        settings.setdefault("GENERATIONS", generations)
+    if "GENERATIONS" in settings and "EPSILON_DECAY" not in settings:
+        settings["EPSILON_DECAY"] = 1 / (settings["GENERATIONS"] * 2)
+    if "MEM_SIZE" in settings and "REPLAY_BATCH_SIZE" not in settings:
+        settings["REPLAY_BATCH_SIZE"] = settings["MEM_SIZE"]
+    return settings
+
+def run_config(job: tuple) -> dict:
+    index, config, seed, generations, max_episode_steps = job
+
+    random.seed(seed)
+    np.random.seed(seed)
+    main_loop.configure(derived_settings(config, generations))
+    main_loop.headless = True
+    main_loop.generation = 0
+    main_loop.farm = None
+
+    start = time.perf_counter()
+    episode_steps = []
+    first_win = None
+    total_steps = 0
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        main_loop.init_key_items()
+        main_loop.init_grid()
+        bot = main_loop.key_items["bot"]
+        main_loop.warm_start(bot)
+
+        for i in range(generations):
+            start_generation = main_loop.generation
+            steps = 0
+            while main_loop.generation == start_generation and steps < max_episode_steps:
+                bot._update(0)
+                steps += 1
+
+            total_steps += steps
+            episode_steps.append(steps)
+
+            if main_loop.generation == start_generation:
+                # give up on this farm and start the next generation
+                bot.next_q = None
+                main_loop.init_grid()
+            elif first_win is None:
+                first_win = (i + 1, total_steps)
+
+    wall_time = time.perf_counter() - start
+    return {
+        "index": index,
+        "seed": seed,
+        "config": config,
+        "generations_to_first_win": first_win[0] if first_win else None,
+        "steps_to_first_win": first_win[1] if first_win else None,
+        "mean_steps_per_episode": float(np.mean(episode_steps)),
+        "total_steps": total_steps,
+        "updates_per_second": bot.updates / wall_time,
+        "wall_time_s": wall_time,
+    }
+
+def format_table(rows: list, columns: list) -> str:
+    cells = [[("%.4g" % row[c]) if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(line[i]) for line in cells)) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.rjust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(v.rjust(w) for v, w in zip(line, widths)) for line in cells]
+    return "\n".join(lines)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Train many headless configurations in parallel and tabulate the results")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUES",
+        help="main_loop setting to vary, e.g. gamma=0.8,0.9 or learning_rate=0.0001:0.001 (ranges need --random); repeat for more settings")
+    parser.add_argument("--random", type=int, default=0, metavar="N", help="sample N random configurations instead of the full grid")
+    parser.add_argument("--repeats", type=int, default=1, help="runs per configuration, each with its own seed")
+    parser.add_argument("--generations", type=int, default=20, help="generations to train per run")
+    parser.add_argument("--max-episode-steps", type=int, default=20000, help="give up on a generation after this many steps")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="sweep.csv", help="where to write the results table as CSV")
+    args = parser.parse_args()
+
+    params = dict(parse_param(text) for text in args.param)
+    rng = random.Random(args.seed)
+    configs = random_configs(params, args.random, rng) if args.random > 0 else grid_configs(params)
+
+    jobs = []
+    for config in configs:
+        for repeat in range(args.repeats):
+            jobs.append((len(jobs), config, args.seed + len(jobs), args.generations, args.max_episode_steps))
+
+    print("%d runs on %d workers" % (len(jobs), args.workers))
+
+    # one task per child so every run starts from freshly imported settings
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with context.Pool(args.workers, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(run_config, jobs):
+            results.append(result)
+            print("run %d done in %.1f s" % (result["index"], result["wall_time_s"]))
+
+    results.sort(key=lambda result: result["index"])
+    rows = [dict(result["config"], seed=result["seed"], **{k: v for k, v in result.items() if k not in ("index", "config", "seed")}) for result in results]
+    columns = list(params) + ["seed", "generations_to_first_win", "steps_to_first_win", "mean_steps_per_episode", "total_steps", "updates_per_second", "wall_time_s"]
+
+    print(format_table(rows, columns))
+
+    with open(args.output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print("wrote %s" % args.output)
+
+if __name__ == "__main__":
+    main()